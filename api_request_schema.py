@@ -1,310 +1,136 @@
-api_request_list = {
-    # Amazon Titan Models
-    'amazon.titan-text-express-v1': {
-        "modelId": "amazon.titan-text-express-v1",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "inputText": "",
-            "textGenerationConfig": {
-                "maxTokenCount": 4096,
-                "stopSequences": [],
-                "temperature": 0.7,
-                "topP": 0.9
-            }
-        }
-    },
-    'amazon.titan-text-lite-v1': {
-        "modelId": "amazon.titan-text-lite-v1",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "inputText": "",
-            "textGenerationConfig": {
-                "maxTokenCount": 4096,
-                "stopSequences": [],
-                "temperature": 0.7,
-                "topP": 0.9
-            }
-        }
-    },
-    'amazon.titan-text-premier-v1:0': {
-        "modelId": "amazon.titan-text-premier-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "inputText": "",
-            "textGenerationConfig": {
-                "maxTokenCount": 4096,
-                "stopSequences": [],
-                "temperature": 0.7,
-                "topP": 0.9
-            }
-        }
-    },
-    
-    # Anthropic Claude 4 Models (Messages API)
-    'us.anthropic.claude-sonnet-4-20250514-v1:0': {
-        "modelId": "us.anthropic.claude-sonnet-4-20250514-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "messages": [],
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    
-    # Anthropic Claude 3.5 Models (Messages API)
-    'us.anthropic.claude-3-5-sonnet-20241022-v2:0': {
-        "modelId": "us.anthropic.claude-3-5-sonnet-20241022-v2:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "messages": [],
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    'us.anthropic.claude-3-5-sonnet-20240620-v1:0': {
-        "modelId": "us.anthropic.claude-3-5-sonnet-20240620-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "messages": [],
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    'us.anthropic.claude-3-5-haiku-20241022-v1:0': {
-        "modelId": "us.anthropic.claude-3-5-haiku-20241022-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "messages": [],
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    
-    # Anthropic Claude 3 Models (Messages API)
-    'anthropic.claude-3-opus-20240229-v1:0': {
-        "modelId": "anthropic.claude-3-opus-20240229-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "messages": [],
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    'anthropic.claude-3-sonnet-20240229-v1:0': {
-        "modelId": "anthropic.claude-3-sonnet-20240229-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "messages": [],
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    'anthropic.claude-3-haiku-20240307-v1:0': {
-        "modelId": "anthropic.claude-3-haiku-20240307-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "messages": [],
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    
-    # Legacy Anthropic Claude Models (Completion API)
-    'anthropic.claude-v2:1': {
-        "modelId": "anthropic.claude-v2:1",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_tokens_to_sample": 4096,
-            "temperature": 0.7,
-            "top_k": 250,
-            "top_p": 0.9,
-            "stop_sequences": ["\n\nHuman:"],
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    'anthropic.claude-v2': {
-        "modelId": "anthropic.claude-v2",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_tokens_to_sample": 4096,
-            "temperature": 0.7,
-            "top_k": 250,
-            "top_p": 0.9,
-            "stop_sequences": ["\n\nHuman:"],
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    'anthropic.claude-instant-v1': {
-        "modelId": "anthropic.claude-instant-v1",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_tokens_to_sample": 4096,
-            "temperature": 0.7,
-            "top_k": 250,
-            "top_p": 0.9,
-            "stop_sequences": ["\n\nHuman:"],
-            "anthropic_version": "bedrock-2023-05-31"
-        }
-    },
-    
-    # Meta Llama Models
-    'meta.llama3-2-90b-instruct-v1:0': {
-        "modelId": "meta.llama3-2-90b-instruct-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_gen_len": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    },
-    'meta.llama3-2-11b-instruct-v1:0': {
-        "modelId": "meta.llama3-2-11b-instruct-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_gen_len": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    },
-    'meta.llama3-2-3b-instruct-v1:0': {
-        "modelId": "meta.llama3-2-3b-instruct-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_gen_len": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    },
-    'meta.llama3-1-70b-instruct-v1:0': {
-        "modelId": "meta.llama3-1-70b-instruct-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_gen_len": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    },
-    'meta.llama3-1-8b-instruct-v1:0': {
-        "modelId": "meta.llama3-1-8b-instruct-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_gen_len": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    },
-    
-    # Legacy Meta Llama Models
-    'meta.llama2-70b-chat-v1': {
-        "modelId": "meta.llama2-70b-chat-v1",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_gen_len": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    },
-    'meta.llama2-13b-chat-v1': {
-        "modelId": "meta.llama2-13b-chat-v1",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_gen_len": 4096,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    },
-    
-    # Cohere Models
-    'cohere.command-r-plus-v1:0': {
-        "modelId": "cohere.command-r-plus-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "message": "",
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "p": 0.9
-        }
-    },
-    'cohere.command-r-v1:0': {
-        "modelId": "cohere.command-r-v1:0",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "message": "",
-            "max_tokens": 4096,
-            "temperature": 0.7,
-            "p": 0.9
-        }
-    },
-    
-    # Legacy Cohere Models
-    'cohere.command-text-v14': {
-        "modelId": "cohere.command-text-v14",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_tokens": 4096,
-            "temperature": 0.7,
-        }
-    },
-    'cohere.command-light-text-v14': {
-        "modelId": "cohere.command-light-text-v14",
-        "contentType": "application/json",
-        "accept": "*/*",
-        "body": {
-            "prompt": "",
-            "max_tokens": 4096,
-            "temperature": 0.7,
-        }
-    },
-}
+import copy
+import json
+import os
+
+# The supported models are listed in model_catalog.json, loaded and validated once at import:
+#   "templates" holds one request body per provider family, with the path to its output token limit.
+#   "models" lists each model id with its provider family, its Bedrock API ("converse" streams through ConverseStream
+#   with the messages built from the conversation, "invoke" sends the body through InvokeModelWithResponseStream),
+#   whether it can stream, its output token limit and its typical time to first token. An optional "body" is merged
+#   over the family template, e.g. {"temperature": 0.2}.
+# The family decides how the request body is built and how streamed chunks are decoded (see model_codecs.py).
+
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_catalog.json')
+MODEL_APIS = ('invoke', 'converse')
+MODEL_FIELDS = {'id', 'family', 'api', 'streaming', 'max_output_tokens', 'first_token_ms', 'body'}
+
+
+class ModelInfo:
+
+    def __init__(self, model_id, family, api, streaming, max_output_tokens, first_token_ms, request, max_tokens_field):
+        self.model_id = model_id
+        self.family = family
+        self.api = api
+        self.streaming = streaming
+        self.max_output_tokens = max_output_tokens
+        self.first_token_ms = first_token_ms
+        self.request = request  # InvokeModelWithResponseStream arguments; the body is deep-copied per request
+        self.max_tokens_field = max_tokens_field  # Path to the output token limit in the body
+
+    def __repr__(self):
+        return f'ModelInfo({self.model_id!r}, {self.family!r}, {self.api!r})'
+
+
+def merge(body, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(body.get(key), dict):
+            merge(body[key], value)
+        else:
+            body[key] = value
+
+
+def limit_tokens(body, max_tokens_field, max_tokens):
+    # Lowers the output token limit of a request body, in place
+    *path, name = max_tokens_field
+    for key in path:
+        body = body[key]
+    body[name] = min(body[name], max_tokens)
+
+
+def build_request(model_id, template, max_output_tokens, overrides):
+    body = copy.deepcopy(template['body'])
+    merge(body, overrides)
+    # The template limit is a default, never more than the model can produce
+    limit_tokens(body, template['max_tokens_field'], max_output_tokens)
+    return {
+        'modelId': model_id,
+        'contentType': 'application/json',
+        'accept': '*/*',
+        'body': body,
+    }
+
+
+def load_catalog(path):
+    with open(path) as f:
+        data = json.load(f)
+
+    templates = data['templates']
+    catalog = {}
+    for entry in data['models']:
+        model_id = entry.get('id')
+        problems = []
+        if not isinstance(model_id, str) or not model_id:
+            problems.append('missing id')
+        elif model_id in catalog:
+            problems.append('listed twice')
+        unknown = set(entry) - MODEL_FIELDS
+        if unknown:
+            problems.append(f'unknown fields {sorted(unknown)}')
+        missing = MODEL_FIELDS - {'body'} - set(entry)
+        if missing:
+            problems.append(f'missing fields {sorted(missing)}')
+        else:
+            if entry['family'] not in templates:
+                problems.append(f"unknown family {entry['family']!r}")
+            if entry['api'] not in MODEL_APIS:
+                problems.append(f"api must be one of {MODEL_APIS}, not {entry['api']!r}")
+            if not isinstance(entry['streaming'], bool):
+                problems.append('streaming must be true or false')
+            if not isinstance(entry['max_output_tokens'], int) or entry['max_output_tokens'] <= 0:
+                problems.append('max_output_tokens must be a positive integer')
+            if not isinstance(entry['first_token_ms'], (int, float)) or entry['first_token_ms'] <= 0:
+                problems.append('first_token_ms must be a positive number')
+            if not isinstance(entry.get('body', {}), dict):
+                problems.append('body must be an object')
+        if problems:
+            raise ValueError(f"{path}: model {model_id!r}: {', '.join(problems)}")
+
+        catalog[model_id] = ModelInfo(
+            model_id,
+            entry['family'],
+            entry['api'],
+            entry['streaming'],
+            entry['max_output_tokens'],
+            entry['first_token_ms'],
+            build_request(model_id, templates[entry['family']], entry['max_output_tokens'], entry.get('body', {})),
+            templates[entry['family']]['max_tokens_field'],
+        )
+    return catalog
+
+
+# Indexes, built once; in catalog order
+model_catalog = load_catalog(CATALOG_FILE)
+model_ids = tuple(model_catalog)
+models_by_family = {}
+for info in model_catalog.values():
+    models_by_family.setdefault(info.family, []).append(info)
+api_request_list = {model_id: info.request for model_id, info in model_catalog.items()}
 
 
 def get_model_ids():
-    return list(api_request_list.keys())
+    return model_ids
+
+
+def get_model(model_id):
+    return model_catalog[model_id]
+
+
+def get_model_api(model_id):
+    return model_catalog[model_id].api
+
+
+def get_model_family(model_id):
+    try:
+        return model_catalog[model_id].family
+    except KeyError:
+        raise NotImplementedError(f'Unknown model: {model_id}') from None
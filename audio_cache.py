@@ -0,0 +1,191 @@
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class MappedAudio:
+    # File-like view over a cached PCM file, read straight from the page cache
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.position = 0
+
+    def read(self, size):
+        data = self.map[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.map.close()
+
+
+class CachingStream:
+    # Passes a Polly AudioStream through while teeing it into the cache; only a fully read stream is committed
+
+    def __init__(self, cache, key, stream):
+        self.cache = cache
+        self.key = key
+        self.stream = stream
+        # A unique name: the same key can be synthesized by several streams at once, also on one pool thread
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.directory, prefix=f'{key}.', suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+        self.finished = False
+
+    def read(self, size):
+        data = self.stream.read(size)
+        if data:
+            self.file.write(data)
+            self.size += len(data)
+        elif not self.finished:
+            self.finished = True
+            self.file.close()
+            self.cache.commit(self.key, self.tmp_path, self.size)
+        return data
+
+    def close(self):
+        self.stream.close()
+        if not self.finished:
+            self.finished = True
+            self.file.close()
+            self.cache.discard(self.tmp_path)
+
+
+class AudioCache:
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = OrderedDict()  # key -> size, least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+    @staticmethod
+    def key(text, voice, engine, rate, sample_rate):
+        material = '\x1f'.join([text, voice, engine, str(rate), str(sample_rate)])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.pcm')
+
+    def marks_path(self, key):
+        return os.path.join(self.directory, f'{key}.marks.json')
+
+    def load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                # Left over from an interrupted run
+                self.discard(path)
+            elif name.endswith('.marks.json'):
+                # Kept only with their audio
+                if not os.path.exists(self.path(name[:-len('.marks.json')])):
+                    self.discard(path)
+            elif name.endswith('.pcm'):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-len('.pcm')], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self.index[key] = size
+            self.total_bytes += size
+        self.evict()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+            self.index.move_to_end(key)
+            self.hits += 1
+
+        try:
+            # Recency survives restarts through the file mtime
+            os.utime(self.path(key))
+            return MappedAudio(self.path(key))
+        except (OSError, ValueError):
+            with self.lock:
+                self.forget(key)
+            return None
+
+    def wrap(self, key, stream):
+        try:
+            return CachingStream(self, key, stream)
+        except OSError:
+            return stream
+
+    def get_marks(self, key):
+        # Polly's speech marks for the audio of `key`, None when they were never stored
+        try:
+            with open(self.marks_path(key)) as f:
+                return [tuple(mark) for mark in json.load(f)]
+        except (OSError, ValueError):
+            return None
+
+    def put_marks(self, key, marks):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f'{key}.', suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(marks, f)
+            os.replace(tmp_path, self.marks_path(key))
+        except OSError:
+            # Requested again next time
+            self.discard(tmp_path)
+
+    def commit(self, key, tmp_path, size):
+        if size == 0:
+            self.discard(tmp_path)
+            return
+
+        try:
+            os.replace(tmp_path, self.path(key))
+        except OSError:
+            # Not worth failing playback over, the phrase is synthesized again next time
+            self.discard(tmp_path)
+            return
+        with self.lock:
+            if key in self.index:
+                self.total_bytes -= self.index[key]
+            self.index[key] = size
+            self.total_bytes += size
+            self.evict()
+
+    def discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def forget(self, key):
+        size = self.index.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+        self.discard(self.path(key))
+        self.discard(self.marks_path(key))
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.index:
+            key = next(iter(self.index))
+            self.forget(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.index),
+                'bytes': self.total_bytes,
+            }
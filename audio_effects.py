@@ -0,0 +1,227 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+# Streaming PCM processing between Polly and the output device, on 16-bit mono blocks of any size:
+#   TimeStretcher  WSOLA time stretching, so the speech rate is applied at playback instead of in the Polly request:
+#                  it can change mid-answer, and audio synthesized (and cached) at one rate plays at any other
+#   Normalizer     loudness normalization towards a target RMS level, with a smoothed, bounded gain
+#   Resampler      linear interpolation from Polly's sample rate to the device's
+# Each keeps the state it needs between blocks and works on whole arrays. `python audio_effects.py` measures the real
+# time factor of each stage on one CPU core.
+
+
+class TimeStretcher:
+    # Waveform similarity overlap-add: Hann frames are taken from the input every `rate` * hop samples and added up
+    # every hop samples, each one shifted by up to `search_ms` to line up with the waveform the previous frame would
+    # have continued with. Speech keeps its pitch, unlike resampling.
+
+    def __init__(self, sample_rate, rate=1.0, frame_ms=20, search_ms=8):
+        self.size = sample_rate * frame_ms // 1000 // 2 * 2
+        self.hop = self.size // 2
+        self.search = sample_rate * search_ms // 1000
+        # Periodic Hann windows at half overlap add up to exactly 1
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.size) / self.size)).astype(np.float32)
+        self.rate = rate  # Read for every frame, so it may be changed at any time
+        self.reset()
+
+    def reset(self):
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.position = 0.0  # Where the next frame would be taken from, in the buffer
+        self.previous = None  # Where the previous frame was taken from
+        self.tail = np.zeros(self.hop, dtype=np.float32)  # Second half of the previous frame
+
+    def process(self, samples):
+        if self.previous is None and self.rate == 1.0:
+            # Nothing to stretch yet
+            return samples
+        self.buffer = np.concatenate((self.buffer, samples))
+        size, hop, search, buffer = self.size, self.hop, self.search, self.buffer
+        frames = []
+        while True:
+            start = int(self.position)
+            if self.previous is None:
+                if start + size > len(buffer):
+                    break
+            else:
+                natural = self.previous + hop
+                low = max(start - search, 0)
+                high = start + search
+                if high + size > len(buffer) or natural + size > len(buffer):
+                    break
+                similarity = np.correlate(buffer[low:high + size], buffer[natural:natural + size], 'valid')
+                start = low + int(np.argmax(similarity))
+
+            frame = buffer[start:start + size] * self.window
+            frames.append(self.tail + frame[:hop])
+            self.tail = frame[hop:]
+            self.previous = start
+            self.position += hop * self.rate
+
+        # Drops the input no later frame can use
+        consumed = max(0, min(self.previous if self.previous is not None else 0, int(self.position) - search))
+        if consumed:
+            self.buffer = buffer[consumed:]
+            self.position -= consumed
+            self.previous -= consumed
+        return np.concatenate(frames) if frames else np.zeros(0, dtype=np.float32)
+
+    def flush(self):
+        # The end of the stream: the input left over, padded to fill the last frames, then the last half frame
+        if self.previous is None:
+            samples = self.buffer
+        else:
+            samples = np.concatenate((self.process(np.zeros(self.size + 2 * self.search, dtype=np.float32)), self.tail))
+        self.reset()
+        return samples
+
+
+class Normalizer:
+    # Moves the speech level towards `target_dbfs` RMS. The level is followed across blocks, ignoring silence, and the
+    # gain ramps over each block to its new value, so it never jumps.
+
+    def __init__(self, sample_rate, target_dbfs=-18.0, max_gain_db=12.0, gate_dbfs=-50.0, time_constant_ms=400):
+        self.sample_rate = sample_rate
+        self.target_dbfs = target_dbfs
+        self.max_gain_db = max_gain_db
+        self.gate_dbfs = gate_dbfs
+        self.time_constant_ms = time_constant_ms
+        self.level_dbfs = target_dbfs
+        self.gain = 1.0
+
+    def process(self, samples):
+        if not len(samples):
+            return samples
+        level = 10 * np.log10(np.mean(np.square(samples, dtype=np.float64)) / 32768.0 ** 2 + 1e-12)
+        if level > self.gate_dbfs:
+            weight = min(1.0, len(samples) * 1000 / self.sample_rate / self.time_constant_ms)
+            self.level_dbfs += (level - self.level_dbfs) * weight
+        gain = 10 ** (min(self.target_dbfs - self.level_dbfs, self.max_gain_db) / 20)
+        ramp = np.linspace(self.gain, gain, len(samples), dtype=np.float32)
+        self.gain = gain
+        return samples * ramp
+
+
+class Resampler:
+    # Linear interpolation, meant for raising Polly's 16 kHz to the device's native rate; the position between input
+    # samples carries over from block to block.
+
+    def __init__(self, input_rate, output_rate):
+        self.step = input_rate / output_rate
+        self.reset()
+
+    def reset(self):
+        self.previous = np.zeros(1, dtype=np.float32)  # Last input sample of the previous block
+        self.position = 1.0  # Of the next output sample, counted from `previous`
+
+    def process(self, samples):
+        if self.step == 1.0 or not len(samples):
+            return samples
+        x = np.concatenate((self.previous, samples))
+        count = int(np.ceil((len(x) - 1 - self.position) / self.step))
+        if count <= 0:
+            self.previous = x[-1:]
+            self.position -= len(samples)
+            return np.zeros(0, dtype=np.float32)
+        t = self.position + np.arange(count) * self.step
+        i = t.astype(np.int64)
+        fraction = (t - i).astype(np.float32)
+        samples = x[i] + (x[np.minimum(i + 1, len(x) - 1)] - x[i]) * fraction
+        self.position = self.position + count * self.step - (len(x) - 1)
+        self.previous = x[-1:]
+        return samples
+
+
+class AudioEffects:
+    # The stages in order, on 16-bit PCM bytes. Blocks may split samples, an odd byte waits for the next block.
+
+    def __init__(self, input_rate, output_rate, rate=1.0, time_stretch=True, normalize=True, target_dbfs=-18.0,
+                 max_gain_db=12.0, frame_ms=20, search_ms=8):
+        self.input_rate = int(input_rate)
+        self.output_rate = int(output_rate)
+        self.stretcher = TimeStretcher(self.input_rate, rate, frame_ms, search_ms) if time_stretch else None
+        self.normalizer = Normalizer(self.input_rate, target_dbfs, max_gain_db) if normalize else None
+        self.resampler = Resampler(self.input_rate, self.output_rate)
+        self.odd = b''
+
+    @property
+    def time_stretch(self):
+        return self.stretcher is not None
+
+    def set_rate(self, rate):
+        if self.stretcher is not None:
+            self.stretcher.rate = rate
+
+    def run(self, samples, end=False):
+        if self.stretcher is not None:
+            samples = self.stretcher.process(samples)
+            if end:
+                samples = np.concatenate((samples, self.stretcher.flush()))
+        if self.normalizer is not None:
+            samples = self.normalizer.process(samples)
+        samples = self.resampler.process(samples)
+        return np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+
+    def process(self, data):
+        data = self.odd + data
+        usable = len(data) // 2 * 2
+        self.odd = data[usable:]
+        return self.run(np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32))
+
+    def flush(self):
+        # The end of one stream; the level the normalizer follows carries on to the next one
+        data = self.run(np.zeros(0, dtype=np.float32), end=True)
+        self.reset()
+        return data
+
+    def reset(self):
+        # Drops what is buffered, e.g. when playback was interrupted
+        if self.stretcher is not None:
+            self.stretcher.reset()
+        self.resampler.reset()
+        self.odd = b''
+
+
+def benchmark(seconds=30.0, input_rate=16000, output_rate=48000, block=8192, rate=1.5):
+    # Real time factor (CPU time / audio time) of each stage on one core, fed in Speaker-sized blocks
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * input_rate)) / input_rate
+    # Voiced-like signal: a wandering pitch with harmonics, in syllables
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / input_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6)) * (np.sin(2 * np.pi * 4 * t) > -0.3)
+    pcm = ((voiced * 0.2 + rng.normal(0, 0.01, len(t))) * 32767 * 0.5).astype(np.int16).tobytes()
+
+    stages = {
+        'resample': dict(time_stretch=False, normalize=False),
+        'normalize': dict(time_stretch=False, normalize=True, output_rate=input_rate),
+        f'stretch x{rate}': dict(time_stretch=True, normalize=False, output_rate=input_rate),
+        'all': dict(time_stretch=True, normalize=True),
+    }
+    results = {}
+    for name, options in stages.items():
+        effects = AudioEffects(input_rate, options.pop('output_rate', output_rate), rate=rate, **options)
+        started = time.process_time()
+        out = 0
+        for offset in range(0, len(pcm), block):
+            out += len(effects.process(pcm[offset:offset + block]))
+        out += len(effects.flush())
+        cpu = time.process_time() - started
+        results[name] = round(cpu / seconds, 5)
+        print(f'[EFFECTS] {name:<14} real time factor {results[name]:.5f}  ({cpu * 1000:.1f} ms CPU for {seconds:.0f} s, '
+              f'{out // 2} samples out)')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Real time factor of the playback audio effects on one CPU core')
+    parser.add_argument('--seconds', type=float, default=30.0, help='Audio to process')
+    parser.add_argument('--output-rate', type=int, default=48000, help='Device sample rate to resample to')
+    parser.add_argument('--block', type=int, default=8192, help='Bytes per block, as read from Polly')
+    parser.add_argument('--rate', type=float, default=1.5, help='Speech rate to stretch to')
+    args = parser.parse_args()
+    benchmark(args.seconds, output_rate=args.output_rate, block=args.block, rate=args.rate)
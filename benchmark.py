@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import resource
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from api_request_schema import api_request_list, models_by_family
+from fakes import (SCRIPTED_ANSWER, SCRIPTED_TRANSCRIPTS, FakeBedrockRuntime, FakePolly, FakeTranscribeStreaming,
+                   NullAudioOutput, synthetic_silence, synthetic_speech)
+from latency import LatencyRecorder, percentile
+from logs import close_logging, configure_logging
+from model_codecs import get_codec
+from session import SharedResources, VoiceSession, create_router
+from settings import config
+from voice_services import AudioSink
+
+# Offline benchmark of the whole voice pipeline, headless and without AWS: recorded (or synthetic) utterances go
+# through VoiceSessions in microphone-sized blocks, as MicStream delivers them, against fake Transcribe, Bedrock and
+# Polly clients and a null audio device. One run per provider family, e.g.
+#   python benchmark.py --wav question1.wav --wav question2.wav --sessions 4 --json results.json
+
+SAMPLE_RATE = 16000
+
+
+def load_wav(path):
+    with wave.open(path, 'rb') as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2 or f.getframerate() != SAMPLE_RATE:
+            raise ValueError(f'{path}: expected a 16 kHz 16-bit mono WAV file')
+        return f.readframes(f.getnframes())
+
+
+def family_models():
+    # The first streaming model of each provider family
+    models = {}
+    for family, infos in models_by_family.items():
+        streaming = [info.model_id for info in infos if info.streaming]
+        if streaming:
+            models[family] = streaming[0]
+    return models
+
+
+async def feed(session, utterances, speed, rng, timeout=60):
+    # Each utterance, then silence until its answer has been played, like a user waiting for the reply
+    loop = asyncio.get_running_loop()
+    block_bytes = config['mic']['blocksize'] * 2
+    block_delay = config['mic']['blocksize'] / SAMPLE_RATE / speed
+    silence = synthetic_silence(config['mic']['blocksize'] / SAMPLE_RATE, rng)
+
+    async def blocks(pcm):
+        for offset in range(0, len(pcm), block_bytes):
+            yield pcm[offset:offset + block_bytes]
+            await asyncio.sleep(block_delay)
+
+    async for block in blocks(synthetic_silence(0.3, rng)):
+        yield block
+
+    for pcm in utterances:
+        async for block in blocks(pcm):
+            yield block
+
+        started = loop.time()
+        turns = session.latency.turn_count
+        while turns == session.latency.turn_count or session.bedrock_wrapper.tasks:
+            if loop.time() - started > timeout:
+                raise TimeoutError(f'Session {session.session_id}: no answer within {timeout} s')
+            yield silence
+            await asyncio.sleep(block_delay)
+
+
+async def run_family(model_id, utterances, args):
+    sessions, speed, jitter = args.sessions, args.speed, args.jitter
+    codec = get_codec(model_id)
+    # Independent fake endpoints (regions), each with its own share of slow and throttled requests
+    endpoints = [
+        FakeBedrockRuntime(codec.family, SCRIPTED_ANSWER, jitter=jitter, seed=i, slow_rate=args.slow_rate,
+                           throttle_rate=args.throttle_rate, by_model=args.route)
+        for i in range(1 + args.hedge)
+    ]
+    polly = FakePolly(jitter=jitter)
+    transcribe = FakeTranscribeStreaming(SCRIPTED_TRANSCRIPTS, jitter=jitter)
+    # No caches, every turn goes through the whole pipeline
+    resources = SharedResources(endpoints[0], polly, transcribe, codec,
+                                trace_file=args.trace, bedrock_endpoints=[(endpoint, None) for endpoint in endpoints[1:]],
+                                router=create_router())
+
+    outputs = [NullAudioOutput(SAMPLE_RATE, speed) for _ in range(sessions)]
+    sinks = [AudioSink(output) for output in outputs]
+    voice_sessions = [
+        VoiceSession(resources, sink, session_id=i + 1, echo=False) for i, sink in enumerate(sinks)
+    ]
+
+    api_request = config['bedrock']['api_request']
+    config['bedrock']['api_request'] = api_request_list[model_id]
+    started = time.monotonic()
+    cpu_started = time.process_time()
+    try:
+        await asyncio.gather(*[
+            session.run(feed(session, utterances, speed, np.random.default_rng(i)))
+            for i, session in enumerate(voice_sessions)
+        ])
+    finally:
+        config['bedrock']['api_request'] = api_request
+        for sink in sinks:
+            sink.close()
+    wall = time.monotonic() - started
+    cpu = time.process_time() - cpu_started
+
+    latency = LatencyRecorder()
+    for session in voice_sessions:
+        latency.history.extend(session.latency.history)
+    first_audio = [marks['first_pcm'] for marks in latency.history if 'first_pcm' in marks]
+
+    return {
+        'family': codec.family,
+        'model_id': model_id,
+        'sessions': sessions,
+        'turns': len(latency.history),
+        'wall_s': round(wall, 2),
+        'turns_per_minute': round(len(latency.history) * 60 / wall, 1),
+        'audio_out_s': round(sum(output.bytes_written for output in outputs) / (SAMPLE_RATE * 2), 1),
+        'cpu_s': round(cpu, 2),
+        'cpu_percent': round(100 * cpu / wall, 1),
+        # Peak of the whole process so far, on Linux ru_maxrss is in KiB
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'first_audio_ms': {
+            'p50': percentile(first_audio, 50),
+            'p95': percentile(first_audio, 95),
+            'p99': percentile(first_audio, 99),
+        },
+        'stages': latency.summary(),
+        'speculation': resources.speculation_stats,
+        'hedging': resources.hedging_stats,
+        'routing': resources.router.stats if resources.router else None,
+        'bedrock_requests': [endpoint.requests for endpoint in endpoints],
+    }
+
+
+def format_result(result):
+    first_audio = result['first_audio_ms']
+    return (f"[BENCH] {result['family']:<22}{result['turns']:>4} turns  "
+            f"first audio p50 {first_audio['p50']} p95 {first_audio['p95']} p99 {first_audio['p99']} ms  "
+            f"{result['turns_per_minute']} turns/min  cpu {result['cpu_percent']}%  rss {result['max_rss_mb']} MB")
+
+
+async def run_benchmark(args):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=config['server']['io_workers'], thread_name_prefix='voice-io'))
+
+    rng = np.random.default_rng(0)
+    utterances = [load_wav(path) for path in args.wav] or [synthetic_speech(1.5, rng) for _ in range(2)]
+    models = family_models()
+    families = args.family or list(models)
+
+    results = []
+    for family in families:
+        result = await run_family(models[family], utterances, args)
+        print(format_result(result), flush=True)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the voice pipeline offline with fake AWS clients')
+    parser.add_argument('--wav', action='append', default=[], help='16 kHz 16-bit mono utterance, one turn each')
+    parser.add_argument('--family', action='append', choices=sorted(family_models()),
+                        help='Provider families to run, all by default')
+    parser.add_argument('--sessions', type=int, default=1, help='Concurrent sessions')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Feeds the microphone and plays the answers this many times faster than real time')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Relative jitter of the fake service delays')
+    parser.add_argument('--speculate', action='store_true', help="Enable config['speculation']")
+    parser.add_argument('--hedge', type=int, default=0, help='Extra fake Bedrock endpoints to hedge requests to')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Share of Bedrock requests with a 3 s first token')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of throttled Bedrock requests')
+    parser.add_argument('--route', action='store_true',
+                        help="Enable config['router'], against fake models with their catalog first-token latency")
+    parser.add_argument('--speech-budget', type=float,
+                        help="Seconds of speech every answer is stopped at, instead of config['speech_budget']")
+    parser.add_argument('--effects', action='store_true',
+                        help="Enable config['effects']: answers are time-stretched and normalized at playback")
+    parser.add_argument('--trace', help='Append the latency trace of every turn to this JSON lines file')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+    config['speculation']['enabled'] = args.speculate
+    config['router']['enabled'] = args.route
+    config['effects']['enabled'] = args.effects
+    if args.speech_budget:
+        budget = config['speech_budget']
+        budget['enabled'] = True
+        budget['max_seconds'] = args.speech_budget
+
+    configure_logging(config['logging'])
+    try:
+        asyncio.run(run_benchmark(args))
+    finally:
+        close_logging()
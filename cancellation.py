@@ -0,0 +1,41 @@
+import threading
+
+
+class CancellationToken:
+    # Cooperative cancellation of one turn. ENTER (from the input thread) or barge-in cancels it, and a callback
+    # cancels the turn's asyncio task: the Bedrock stream, pending Polly requests and playback stop at their next await.
+    # Other callbacks can close blocking resources.
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self, reason='cancelled'):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.reason = reason
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
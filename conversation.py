@@ -0,0 +1,84 @@
+import re
+from collections import deque
+
+# Approximate characters per token for each provider family. Close enough to budget the history
+# without shipping a tokenizer per model.
+CHARS_PER_TOKEN = {
+    'anthropic-messages': 3.5,
+    'anthropic-completion': 3.5,
+    'titan': 4.2,
+    'llama': 3.8,
+    'cohere-chat': 4.0,
+    'cohere': 4.0,
+}
+
+
+def estimate_tokens(text, family):
+    return int(len(text) / CHARS_PER_TOKEN.get(family, 4.0)) + 1
+
+
+def first_sentence(text, max_chars=120):
+    sentence = re.split(r'(?<=[.!?])\s', text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rsplit(' ', 1)[0] + '...'
+
+
+class Turn:
+
+    def __init__(self, user, assistant, tokens):
+        self.user = user
+        self.assistant = assistant
+        self.tokens = tokens
+
+
+class ConversationStore:
+
+    def __init__(self, family, token_budget=2000, summarize=True, summary_tokens=200):
+        self.family = family
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+
+        self.turns = deque()
+        self.tokens = 0  # Running total of self.turns, so trimming never re-estimates old turns
+        self.summary_lines = deque()
+        self.summary_token_count = 0
+
+    def add_turn(self, user, assistant, family=None):
+        # `family` of the model that answered, when routing picked another one than the configured model
+        if not user or not assistant:
+            return
+
+        family = family or self.family
+        turn = Turn(user, assistant, estimate_tokens(user, family) + estimate_tokens(assistant, family))
+        self.turns.append(turn)
+        self.tokens += turn.tokens
+
+        # Oldest turns go first; the latest turn is always kept even if it alone exceeds the budget
+        while self.tokens > self.token_budget and len(self.turns) > 1:
+            dropped = self.turns.popleft()
+            self.tokens -= dropped.tokens
+            if self.summarize:
+                self.add_summary(dropped, family)
+
+    def add_summary(self, turn, family=None):
+        # Cheap extractive summary: the first sentence of each side of the dropped turn
+        line = f'The user asked: {first_sentence(turn.user)} You answered: {first_sentence(turn.assistant)}'
+        tokens = estimate_tokens(line, family or self.family)
+        self.summary_lines.append((line, tokens))
+        self.summary_token_count += tokens
+
+        while self.summary_token_count > self.summary_tokens and self.summary_lines:
+            _, tokens = self.summary_lines.popleft()
+            self.summary_token_count -= tokens
+
+    def summary(self):
+        return ' '.join(line for line, _ in self.summary_lines)
+
+    def history(self):
+        return [(turn.user, turn.assistant) for turn in self.turns]
+
+    def clear(self):
+        self.turns.clear()
+        self.tokens = 0
+        self.summary_lines.clear()
+        self.summary_token_count = 0
@@ -0,0 +1,320 @@
+import asyncio
+import io
+import json
+import random
+import re
+import time
+
+import numpy as np
+from botocore.exceptions import ClientError
+from amazon_transcribe.model import Alternative, Result, Transcript, TranscriptEvent
+
+from api_request_schema import get_model
+from vad import EnergyVad
+
+# Stand-ins for the AWS clients with realistic timing, for load tests and benchmarks without credentials or network.
+# They implement only the calls this app makes. Delays are scaled by a seeded random factor in [1 - jitter, 1 + jitter],
+# so runs are repeatable.
+
+# Typical time to first token (seconds), streaming rate and chunk size of each provider family
+FAMILY_PROFILES = {
+    'titan': {'first_token_delay': 0.6, 'tokens_per_second': 40, 'chars_per_token': 4},
+    'llama': {'first_token_delay': 0.4, 'tokens_per_second': 60, 'chars_per_token': 4},
+    'cohere-chat': {'first_token_delay': 0.5, 'tokens_per_second': 50, 'chars_per_token': 4},
+    'cohere': {'first_token_delay': 0.5, 'tokens_per_second': 40, 'chars_per_token': 4},
+    'anthropic-messages': {'first_token_delay': 0.4, 'tokens_per_second': 60, 'chars_per_token': 4},
+    'anthropic-completion': {'first_token_delay': 0.7, 'tokens_per_second': 40, 'chars_per_token': 16},
+}
+
+SCRIPTED_TRANSCRIPTS = [
+    'What is the tallest mountain in Europe',
+    'And how long does it take to climb it',
+    'Thanks, what should I pack for the trip',
+    'Why is the air so thin up there, can you explain how that affects climbers',
+]
+SCRIPTED_ANSWER = (
+    "Mount Elbrus in the Caucasus is the tallest, at about five thousand six hundred metres. "
+    "Most people climb it in a week, including a few days to acclimatize. Would you like some tips for the trip?"
+)
+
+
+class Jitter:
+
+    def __init__(self, jitter=0.0, seed=0):
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    def __call__(self, delay):
+        if self.jitter:
+            delay *= self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        return delay
+
+
+def synthetic_speech(seconds, rng, sample_rate=16000):
+    # Voiced-sounding audio: a 150 Hz tone with harmonics, modulated at a syllable rate, over low noise
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    voice = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in (1, 2, 3))
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    signal = 0.2 * voice * envelope + rng.normal(0, 0.002, len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes()
+
+
+def synthetic_silence(seconds, rng, sample_rate=16000):
+    return (rng.normal(0, 0.002, int(seconds * sample_rate)) * 32767).astype(np.int16).tobytes()
+
+
+class NullAudioOutput:
+    # Headless output device: blocks for as long as the audio would take to play (divided by `speed`), keeps nothing
+
+    def __init__(self, sample_rate=16000, speed=1.0):
+        self.bytes_per_second = sample_rate * 2 * speed
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        time.sleep(len(data) / self.bytes_per_second)
+
+    def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def encode_text_chunk(family, text):
+    # The streaming chunk format of each model family, as model_codecs decodes it
+    if family == 'anthropic-messages':
+        record = {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': text}}
+    elif family == 'anthropic-completion':
+        record = {'completion': text}
+    elif family == 'titan':
+        record = {'outputText': text}
+    elif family == 'llama':
+        record = {'generation': text}
+    elif family == 'cohere':
+        record = {'generations': [{'text': text}]}
+    else:
+        record = {'event_type': 'text-generation', 'text': text}
+    return json.dumps(record).encode()
+
+
+class FakeEventStream:
+
+    def __init__(self, events, token_delay, jitter):
+        self.events = events
+        self.token_delay = token_delay
+        self.jitter = jitter
+        self.closed = False
+
+    def __iter__(self):
+        for event in self.events:
+            if self.closed:
+                return
+            time.sleep(self.jitter(self.token_delay))
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrockRuntime:
+
+    # A share of the requests can be throttled (`throttle_rate`) or get their first token only after `slow_delay`
+    # (`slow_rate`), to exercise retries and hedging. With `by_model`, every model of the catalog is served, in its
+    # family's format and with its typical time to first token, for routing between models.
+
+    def __init__(self, family, answer, first_token_delay=None, tokens_per_second=None, chars_per_token=None,
+                 jitter=0.0, seed=0, slow_rate=0.0, slow_delay=3.0, throttle_rate=0.0, by_model=False):
+        # Unset timings come from the family profile
+        profile = FAMILY_PROFILES[family]
+        self.family = family
+        self.answer = answer
+        self.first_token_delay = profile['first_token_delay'] if first_token_delay is None else first_token_delay
+        self.token_delay = 1.0 / (profile['tokens_per_second'] if tokens_per_second is None else tokens_per_second)
+        self.chars_per_token = profile['chars_per_token'] if chars_per_token is None else chars_per_token
+        self.jitter = Jitter(jitter, seed)
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.by_model = by_model
+        self.requests = 0
+
+    def family_of(self, model_id):
+        return get_model(model_id).family if self.by_model else self.family
+
+    def wait_for_first_token(self, operation, model_id):
+        self.requests += 1
+        if self.random.random() < self.throttle_rate:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}}, operation)
+        first_token_delay = get_model(model_id).first_token_ms / 1000 if self.by_model else self.first_token_delay
+        slow = self.random.random() < self.slow_rate
+        time.sleep(self.jitter(self.slow_delay if slow else first_token_delay))
+
+    def tokens(self):
+        return re.findall(rf'.{{1,{self.chars_per_token}}}', self.answer, re.S)
+
+    def invoke_model_with_response_stream(self, body, modelId, accept, contentType):
+        self.wait_for_first_token('InvokeModelWithResponseStream', modelId)
+        family = self.family_of(modelId)
+        events = [{'chunk': {'bytes': encode_text_chunk(family, token)}} for token in self.tokens()]
+        return {'body': FakeEventStream(events, self.token_delay, self.jitter)}
+
+    def converse_stream(self, modelId, messages, system=None, inferenceConfig=None):
+        started = time.monotonic()
+        self.wait_for_first_token('ConverseStream', modelId)
+        tokens = self.tokens()
+        events = [{'messageStart': {'role': 'assistant'}}]
+        events += [{'contentBlockDelta': {'delta': {'text': token}, 'contentBlockIndex': 0}} for token in tokens]
+        events += [
+            {'contentBlockStop': {'contentBlockIndex': 0}},
+            {'messageStop': {'stopReason': 'end_turn'}},
+            {'metadata': {
+                'usage': {
+                    'inputTokens': sum(len(block['text']) for m in messages for block in m['content']) // 4,
+                    'outputTokens': len(tokens),
+                },
+                'metrics': {'latencyMs': int((time.monotonic() - started) * 1000)},
+            }},
+        ]
+        return {'stream': FakeEventStream(events, self.token_delay, self.jitter)}
+
+
+class FakePolly:
+    # Returns silence as long as the text would take to speak
+
+    def __init__(self, first_byte_delay=0.1, chars_per_second=15, jitter=0.0, seed=0):
+        self.first_byte_delay = first_byte_delay
+        self.chars_per_second = chars_per_second
+        self.jitter = Jitter(jitter, seed)
+        self.requests = 0
+
+    def synthesize_speech(self, Text, TextType, Engine, LanguageCode, VoiceId, OutputFormat, SampleRate=None,
+                          SpeechMarkTypes=()):
+        self.requests += 1
+        time.sleep(self.jitter(self.first_byte_delay))
+        if OutputFormat == 'json':
+            return {'AudioStream': io.BytesIO(self.speech_marks(Text, SpeechMarkTypes))}
+        text = re.sub(r'<[^>]+>', '', Text)
+        seconds = len(text) / self.chars_per_second
+        return {'AudioStream': io.BytesIO(bytes(int(seconds * int(SampleRate)) * 2))}
+
+    def speech_marks(self, text, types):
+        # Word marks timed like the silence above, with byte offsets into the text including its SSML markup
+        if 'word' not in types:
+            return b''
+        lines = []
+        for match in re.finditer(r'[^\s<>]+(?![^<]*>)', text):
+            spoken = len(re.sub(r'<[^>]+>', '', text[:match.start()]))
+            start = len(text[:match.start()].encode('utf-8'))
+            lines.append(json.dumps({'time': int(spoken / self.chars_per_second * 1000), 'type': 'word', 'start': start,
+                                     'end': start + len(match.group().encode('utf-8')), 'value': match.group()}))
+        return '\n'.join(lines).encode('utf-8')
+
+
+class FakeInputStream:
+
+    def __init__(self, transcription):
+        self.transcription = transcription
+
+    async def send_audio_event(self, audio_chunk):
+        self.transcription.on_audio(audio_chunk)
+
+    async def end_stream(self):
+        self.transcription.put(None)
+
+
+class FakeOutputStream:
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+class FakeTranscription:
+    # Detects speech in the incoming audio like the service would and answers each utterance with the next scripted
+    # transcript: growing partial results while speech lasts, a final result after a short silence, and an empty
+    # event every `empty_event_ms` of silence.
+
+    def __init__(self, transcripts, sample_rate=16000, result_delay=0.15, final_silence_ms=400, partial_ms=300,
+                 ms_per_word=150, empty_event_ms=1000, jitter=0.0, seed=0):
+        self.transcripts = transcripts
+        self.result_delay = result_delay
+        self.jitter = Jitter(jitter, seed)
+        self.final_silence_ms = final_silence_ms
+        self.partial_ms = partial_ms
+        self.ms_per_word = ms_per_word
+        self.empty_event_ms = empty_event_ms
+
+        self.vad = EnergyVad(sample_rate=sample_rate)
+        self.sample_rate = sample_rate
+        self.queue = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        self.input_stream = FakeInputStream(self)
+        self.output_stream = FakeOutputStream(self.queue)
+
+        self.utterance = 0
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self.since_partial_ms = 0
+        self.deliver_at = 0.0
+
+    def put(self, event):
+        # Jittered, but never out of order
+        self.deliver_at = max(self.loop.time() + self.jitter(self.result_delay), self.deliver_at + 1e-6)
+        self.loop.call_at(self.deliver_at, self.queue.put_nowait, event)
+
+    def result(self, text, is_partial):
+        result = Result(
+            result_id=f'fake-{self.utterance}',
+            is_partial=is_partial,
+            alternatives=[Alternative(transcript=text, items=[])],
+        )
+        return TranscriptEvent(Transcript(results=[result]))
+
+    def on_audio(self, chunk):
+        chunk_ms = len(chunk) * 1000 // (2 * self.sample_rate)
+        speech = self.vad.process(chunk)
+        if speech.any():
+            self.speech_ms += int(speech.sum()) * self.vad.frame_ms
+            self.silence_ms = 0
+        else:
+            self.silence_ms += chunk_ms
+
+        words = self.transcripts[self.utterance % len(self.transcripts)].split()
+        if self.speech_ms and self.silence_ms >= self.final_silence_ms:
+            self.put(self.result(' '.join(words), is_partial=False))
+            self.utterance += 1
+            self.speech_ms = 0
+            self.since_partial_ms = 0
+        elif self.speech_ms:
+            self.since_partial_ms += chunk_ms
+            if self.since_partial_ms >= self.partial_ms:
+                self.since_partial_ms = 0
+                heard = words[:1 + self.speech_ms // self.ms_per_word]
+                self.put(self.result(' '.join(heard), is_partial=True))
+        elif self.silence_ms >= self.empty_event_ms:
+            self.silence_ms = 0
+            self.put(TranscriptEvent(Transcript(results=[])))
+
+
+class FakeTranscribeStreaming:
+
+    def __init__(self, transcripts, **transcription_args):
+        self.transcripts = transcripts
+        self.transcription_args = transcription_args
+        self.streams = 0
+
+    async def start_stream_transcription(self, language_code, media_sample_rate_hz, media_encoding):
+        self.streams += 1
+        # A different, still deterministic, jitter sequence per stream
+        return FakeTranscription(
+            self.transcripts, sample_rate=media_sample_rate_hz, seed=self.streams, **self.transcription_args)
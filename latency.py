@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+
+# Pipeline stages of a voice turn, in the order they are expected to happen
+TURN_MARKS = [
+    'end_of_speech',
+    'bedrock_request',
+    'first_token',
+    'first_sentence',
+    'polly_first_byte',
+    'first_pcm',
+    'last_pcm',
+]
+
+
+class TurnTrace:
+
+    def __init__(self, turn, start=None):
+        self.turn = turn
+        self.start = time.monotonic() if start is None else start
+        self.marks = {}
+        self.lock = threading.Lock()
+
+    def mark(self, name, at=None):
+        at = time.monotonic() if at is None else at
+        with self.lock:
+            # First occurrence wins, later calls for the same stage are no-ops
+            if name not in self.marks:
+                self.marks[name] = at
+
+    def mark_last(self, name, at=None):
+        at = time.monotonic() if at is None else at
+        with self.lock:
+            self.marks[name] = at
+
+    def elapsed_ms(self):
+        with self.lock:
+            return {name: round((at - self.start) * 1000, 1) for name, at in self.marks.items()}
+
+    def to_json(self, **extra):
+        record = {'turn': self.turn}
+        record.update(extra)
+        record['marks_ms'] = self.elapsed_ms()
+        return json.dumps(record)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class LatencyRecorder:
+
+    def __init__(self, trace_file=None):
+        self.trace_file = trace_file
+        self.current = None
+        self.history = []
+        self.turn_count = 0
+        self.lock = threading.Lock()
+
+    def start_turn(self):
+        with self.lock:
+            self.turn_count += 1
+            self.current = TurnTrace(self.turn_count)
+            return self.current
+
+    def mark(self, name):
+        trace = self.current
+        if trace is not None:
+            trace.mark(name)
+
+    def mark_last(self, name):
+        trace = self.current
+        if trace is not None:
+            trace.mark_last(name)
+
+    def end_turn(self, **extra):
+        with self.lock:
+            trace, self.current = self.current, None
+        if trace is None:
+            return None
+
+        self.history.append(trace.elapsed_ms())
+        line = trace.to_json(**extra)
+        if self.trace_file:
+            with open(self.trace_file, 'a') as f:
+                f.write(line + '\n')
+        return line
+
+    def summary(self):
+        result = {}
+        for name in TURN_MARKS:
+            values = [marks[name] for marks in self.history if name in marks]
+            if values:
+                result[name] = {
+                    'count': len(values),
+                    'p50': percentile(values, 50),
+                    'p95': percentile(values, 95),
+                    'p99': percentile(values, 99),
+                }
+        return result
+
+    def format_summary(self):
+        summary = self.summary()
+        if not summary:
+            return ''
+
+        lines = [f'[LATENCY] {len(self.history)} turns, ms since end of speech']
+        lines.append(f'[LATENCY] {"stage":<18}{"p50":>10}{"p95":>10}{"p99":>10}')
+        for name, stats in summary.items():
+            lines.append(f'[LATENCY] {name:<18}{stats["p50"]:>10}{stats["p95"]:>10}{stats["p99"]:>10}')
+        return '\n'.join(lines)
@@ -0,0 +1,49 @@
+import threading
+
+from logs import get_logger
+
+log = get_logger('session')
+
+
+class Lazy:
+    # Stands in for something slow to create (an AWS client, an audio device): `factory` runs on the first attribute
+    # access, or ahead of time on a background thread with warm(), so startup does not wait for it
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.value = None
+
+    @property
+    def created(self):
+        return self.value is not None
+
+    def get(self):
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    self.value = self.factory()
+        return self.value
+
+    def close(self):
+        # Nothing to close if it was never created
+        if self.value is not None:
+            self.value.close()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def warm(*objects):
+    # Creates the Lazy objects in order on a daemon thread and returns it; a failure is raised again on first use
+    def create():
+        for obj in objects:
+            if isinstance(obj, Lazy):
+                try:
+                    obj.get()
+                except Exception as e:
+                    log.info('Could not create %r ahead of time: %s', obj.factory, e)
+
+    thread = threading.Thread(target=create, name='warm-up', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from fakes import (SCRIPTED_ANSWER, SCRIPTED_TRANSCRIPTS, FakeBedrockRuntime, FakePolly, FakeTranscribeStreaming,
+                   synthetic_silence, synthetic_speech)
+from latency import percentile
+from logs import close_logging, configure_logging
+from model_codecs import get_codec
+from server import VoiceServer
+from session import SharedResources
+from settings import check_model_id, config, model_id
+
+# Runs the voice server against fake AWS clients and drives it with synthetic audio clients, e.g.
+#   python loadtest.py --sessions 50 --turns 3
+
+BLOCK_BYTES = config['mic']['blocksize'] * 2
+BLOCK_SECONDS = config['mic']['blocksize'] / config['mic']['sample_rate']
+
+class AudioClient:
+    # One user: speaks an utterance, stays silent until the answer has been received, repeats
+
+    def __init__(self, host, port, turns, speech_seconds=1.5, answer_gap=1.0, seed=0):
+        self.host = host
+        self.port = port
+        self.turns = turns
+        self.speech_seconds = speech_seconds
+        self.answer_gap = answer_gap  # Seconds without audio that mean the answer is over
+        self.rng = np.random.default_rng(seed)
+
+        self.received_at = None
+        self.first_audio = None
+        self.latencies = []
+
+    async def receive(self, reader):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            self.received_at = time.monotonic()
+            if self.first_audio is None:
+                self.first_audio = self.received_at
+
+    async def send(self, writer, pcm):
+        # In real time, as a microphone would deliver it
+        for offset in range(0, len(pcm), BLOCK_BYTES):
+            writer.write(pcm[offset:offset + BLOCK_BYTES])
+            await writer.drain()
+            await asyncio.sleep(BLOCK_SECONDS)
+
+    async def run(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        receiver = asyncio.get_running_loop().create_task(self.receive(reader))
+        silence = synthetic_silence(BLOCK_SECONDS, self.rng)
+        try:
+            await self.send(writer, synthetic_silence(0.3, self.rng))
+            for _ in range(self.turns):
+                await self.send(writer, synthetic_speech(self.speech_seconds, self.rng))
+                end_of_speech = time.monotonic()
+                self.first_audio = None
+
+                while receiver.done() is False:
+                    await self.send(writer, silence)
+                    now = time.monotonic()
+                    if self.first_audio is not None and now - self.received_at > self.answer_gap:
+                        break
+                    if now - end_of_speech > 30:
+                        raise TimeoutError('no answer within 30 s')
+                if self.first_audio is None:
+                    break
+                self.latencies.append((self.first_audio - end_of_speech) * 1000)
+        finally:
+            writer.close()
+            receiver.cancel()
+
+
+async def run_load_test(sessions, turns, port):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=config['server']['io_workers'], thread_name_prefix='voice-io'))
+
+    codec = get_codec(model_id)
+    bedrock_runtime = FakeBedrockRuntime(codec.family, SCRIPTED_ANSWER)
+    polly = FakePolly()
+    resources = SharedResources(bedrock_runtime, polly, FakeTranscribeStreaming(SCRIPTED_TRANSCRIPTS), codec)
+    server = VoiceServer(resources, '127.0.0.1', port, max_sessions=sessions)
+
+    async with await server.start():
+        clients = [AudioClient('127.0.0.1', port, turns, seed=i) for i in range(sessions)]
+        started = time.monotonic()
+        results = await asyncio.gather(*[client.run() for client in clients], return_exceptions=True)
+        elapsed = time.monotonic() - started
+        # Lets the sessions notice the closed connections and record their last turn
+        while server.sessions:
+            await asyncio.sleep(0.1)
+
+    failures = [result for result in results if isinstance(result, Exception)]
+    latencies = [value for client in clients for value in client.latencies]
+    print(f'[LOAD] {sessions} sessions x {turns} turns in {elapsed:.1f}s, {len(latencies)} answers, '
+          f'{len(failures)} failed sessions, {bedrock_runtime.requests} Bedrock and {polly.requests} Polly requests')
+    if failures:
+        print(f'[LOAD] First failure: {failures[0]!r}')
+    if latencies:
+        print(f'[LOAD] Client end of speech to first audio ms: p50 {percentile(latencies, 50):.0f}, '
+              f'p95 {percentile(latencies, 95):.0f}, p99 {percentile(latencies, 99):.0f}')
+    summary = server.latency.format_summary()
+    if summary:
+        print(summary)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the voice server with fake AWS clients')
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    check_model_id()
+    configure_logging(config['logging'])
+    try:
+        asyncio.run(run_load_test(args.sessions, args.turns, args.port))
+    finally:
+        close_logging()
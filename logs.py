@@ -0,0 +1,111 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# One stdlib logger per component, under 'voice'. Messages take %-style arguments, so nothing is formatted unless a
+# handler will take the record: with logging off, a call on a hot path costs a method call and a cached level check.
+#   log = get_logger('bedrock')
+#   log.debug('Request body: %s', body)
+
+LEVELS = {'none': logging.CRITICAL + 10, 'info': logging.INFO, 'debug': logging.DEBUG}
+COMPONENTS = ('mic', 'transcribe', 'bedrock', 'router', 'polly', 'playback', 'session', 'server')
+
+root = logging.getLogger('voice')
+root.setLevel(LEVELS['none'])  # Silent until configure_logging() is called
+root.propagate = False
+
+# Attributes every LogRecord has; anything else on a record was passed through `extra` and goes into the JSON line
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def get_logger(component):
+    return logging.getLogger(f'voice.{component}')
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        line = {
+            'ts': round(record.created, 6),
+            'level': record.levelname.lower(),
+            'component': record.name.rpartition('.')[2],
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                line[key] = value
+        if record.exc_info:
+            line['exc'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class RingQueueHandler(logging.handlers.QueueHandler):
+    # Never blocks the caller: when the writer thread falls behind, the oldest queued record makes room
+
+    def __init__(self, size):
+        super().__init__(queue.Queue(maxsize=size))
+        self.dropped = 0
+
+    def enqueue(self, record):
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class JsonSink:
+    # JSON lines written to a file by a background thread, fed through a bounded queue
+
+    def __init__(self, path, size=10000):
+        file_handler = logging.FileHandler(path, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        self.handler = RingQueueHandler(size)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, file_handler)
+        self.listener.start()
+
+    def close(self):
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+sink = None
+
+
+def configure_logging(settings):
+    # `settings` is config['logging']; may be called again to change it
+    global sink
+    close_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    root.setLevel(LEVELS[settings['level']])
+    for component in COMPONENTS:
+        level = settings['components'].get(component)
+        get_logger(component).setLevel(LEVELS[level] if level else logging.NOTSET)
+
+    if settings['console']:
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+        root.addHandler(console)
+    if settings['json_file']:
+        sink = JsonSink(settings['json_file'], settings['ring_size'])
+        root.addHandler(sink.handler)
+
+
+def close_logging():
+    # Flushes the JSON sink; records logged afterwards are dropped
+    global sink
+    if sink is not None:
+        root.removeHandler(sink.handler)
+        sink.close()
+        sink = None
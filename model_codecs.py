@@ -0,0 +1,180 @@
+import copy
+import json
+
+from api_request_schema import get_model_family
+
+# Families whose models reject the ConverseStream system field; their system prompt opens the first user message
+NO_CONVERSE_SYSTEM = {'titan', 'cohere'}
+
+
+class ModelCodec:
+
+    def __init__(self, family, encode, decode):
+        self.family = family
+        self.encode = encode
+        self.decode = decode
+
+    def build_body(self, template, text, system_prompt, history=(), summary=''):
+        # Deep copy, nested dicts such as textGenerationConfig must not be shared between requests
+        body = copy.deepcopy(template)
+        self.encode(body, text, with_summary(system_prompt, summary), history)
+        return body
+
+
+def with_summary(system_prompt, summary):
+    if summary:
+        return f'{system_prompt}\n\nEarlier in this conversation: {summary}'
+    return system_prompt
+
+
+def inference_config(body):
+    # ConverseStream takes the generation limits of the invoke body under provider-neutral names
+    generation = body.get('textGenerationConfig', body)
+    names = {
+        'maxTokens': ('max_tokens', 'max_gen_len', 'maxTokenCount'),
+        'temperature': ('temperature',),
+        'topP': ('top_p', 'p', 'topP'),
+        'stopSequences': ('stop_sequences', 'stopSequences'),
+    }
+    result = {}
+    for name, keys in names.items():
+        for key in keys:
+            if generation.get(key) is not None:
+                result[name] = generation[key]
+                break
+    return result
+
+
+def build_converse_request(api_request, text, system_prompt, history=(), summary=''):
+    # Same conversation for every provider, Bedrock translates it to the model's own prompt format
+    messages = []
+    for user, assistant in history:
+        messages.append({'role': 'user', 'content': [{'text': user}]})
+        messages.append({'role': 'assistant', 'content': [{'text': assistant}]})
+    messages.append({'role': 'user', 'content': [{'text': text}]})
+
+    request = {
+        'modelId': api_request['modelId'],
+        'messages': messages,
+        'inferenceConfig': inference_config(api_request['body']),
+    }
+    system_prompt = with_summary(system_prompt, summary)
+    if get_model_family(api_request['modelId']) in NO_CONVERSE_SYSTEM:
+        first = messages[0]['content'][0]
+        first['text'] = f"{system_prompt}\n\n{first['text']}"
+    else:
+        request['system'] = [{'text': system_prompt}]
+    return request
+
+
+def encode_titan(body, text, system_prompt, history):
+    turns = ''.join(f"Human: {user}\nBot: {assistant}\n" for user, assistant in history)
+    body['inputText'] = f"{system_prompt}\n\n{turns}Human: {text}"
+
+
+def encode_llama(body, text, system_prompt, history):
+    turns = ''.join(f"<|user|>\n{user}\n<|assistant|>\n{assistant}\n" for user, assistant in history)
+    body['prompt'] = f"<|system|>\n{system_prompt}\n{turns}<|user|>\n{text}\n<|assistant|>\n"
+
+
+def encode_cohere_chat(body, text, system_prompt, history):
+    body['message'] = text
+    body['preamble'] = system_prompt
+    if history:
+        body['chat_history'] = []
+        for user, assistant in history:
+            body['chat_history'].append({"role": "USER", "message": user})
+            body['chat_history'].append({"role": "CHATBOT", "message": assistant})
+
+
+def encode_cohere(body, text, system_prompt, history):
+    turns = ''.join(f"User: {user}\nAssistant: {assistant}\n" for user, assistant in history)
+    body['prompt'] = f"{system_prompt}\n\n{turns}User: {text}\nAssistant:"
+
+
+def encode_anthropic_messages(body, text, system_prompt, history):
+    body['system'] = system_prompt
+    body['messages'] = []
+    for user, assistant in history:
+        body['messages'].append({"role": "user", "content": user})
+        body['messages'].append({"role": "assistant", "content": assistant})
+    body['messages'].append({"role": "user", "content": text})
+
+
+def encode_anthropic_completion(body, text, system_prompt, history):
+    # The system prompt opens the first Human turn, later turns alternate Human/Assistant
+    turns = list(history) + [(text, None)]
+    prompt = f'\n\nHuman: {system_prompt}\n\nUser: '
+    for i, (user, assistant) in enumerate(turns):
+        if i > 0:
+            prompt += '\n\nHuman: '
+        prompt += f'{user}\n\nAssistant:'
+        if assistant is not None:
+            prompt += f' {assistant}'
+    body['prompt'] = prompt
+
+
+def decode_titan(payload):
+    return json.loads(payload).get('outputText', '')
+
+
+def decode_llama(payload):
+    return json.loads(payload).get('generation', '')
+
+
+def decode_cohere_chat(payload):
+    # stream-end repeats the whole response and chat history, there is no new text in it
+    if b'"stream-end"' in payload:
+        return ''
+
+    chunk_obj = json.loads(payload)
+    if 'text' in chunk_obj:
+        return chunk_obj['text']
+    if 'delta' in chunk_obj:
+        return chunk_obj['delta'].get('message', {}).get('content', {}).get('text', '')
+    return ''
+
+
+def decode_cohere(payload):
+    chunk_obj = json.loads(payload)
+    if 'generations' in chunk_obj:
+        return ' '.join([c.get("text", "") for c in chunk_obj['generations']])
+    return chunk_obj.get('text', '')
+
+
+def decode_anthropic_messages(payload):
+    # Only content blocks carry text; message_start/stop, content_block_stop and message_delta are skipped unparsed
+    if b'"text":' not in payload:
+        return ''
+
+    chunk_obj = json.loads(payload)
+    if 'delta' in chunk_obj:
+        return chunk_obj['delta'].get('text', '')
+    if 'content_block' in chunk_obj:
+        return chunk_obj['content_block'].get('text', '')
+    if 'message' in chunk_obj:
+        # Non-streaming Messages API format
+        content = chunk_obj['message'].get('content')
+        if isinstance(content, list) and len(content) > 0:
+            return content[0].get('text', '')
+        if isinstance(content, str):
+            return content
+    return ''
+
+
+def decode_anthropic_completion(payload):
+    return json.loads(payload).get('completion', '')
+
+
+model_codecs = {
+    'titan': ModelCodec('titan', encode_titan, decode_titan),
+    'llama': ModelCodec('llama', encode_llama, decode_llama),
+    'cohere-chat': ModelCodec('cohere-chat', encode_cohere_chat, decode_cohere_chat),
+    'cohere': ModelCodec('cohere', encode_cohere, decode_cohere),
+    'anthropic-messages': ModelCodec('anthropic-messages', encode_anthropic_messages, decode_anthropic_messages),
+    'anthropic-completion': ModelCodec('anthropic-completion', encode_anthropic_completion, decode_anthropic_completion),
+}
+
+
+def get_codec(model_id):
+    return model_codecs[get_model_family(model_id)]
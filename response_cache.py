@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+FILLER_WORDS = {'um', 'uh', 'er', 'erm', 'hmm', 'mm', 'ah'}
+
+
+def normalize_transcript(text):
+    # Transcribe punctuates and capitalizes inconsistently, and spoken queries carry filler words
+    words = re.sub(r"[^\w\s']", ' ', text.lower()).split()
+    return ' '.join(word for word in words if word not in FILLER_WORDS)
+
+
+class CachedResponse:
+
+    def __init__(self, sentences, created, audio=None, audio_path=None, audio_lengths=None, marks=None):
+        self.sentences = sentences
+        self.created = created
+        self.audio = audio
+        self.audio_path = audio_path
+        self.audio_lengths = audio_lengths  # Bytes of audio per sentence
+        self.marks = marks  # Speech marks per sentence, None where they had not arrived
+
+    def load_audio(self):
+        if self.audio is not None:
+            return self.audio
+        if self.audio_path and os.path.exists(self.audio_path):
+            with open(self.audio_path, 'rb') as f:
+                return f.read()
+        return None
+
+
+class ResponseCache:
+
+    def __init__(self, directory=None, max_entries=128, max_disk_entries=1024, ttl=24 * 3600, clock=time.time):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.clock = clock
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(transcript, model_id, prompt_config):
+        material = json.dumps([normalize_transcript(transcript), model_id, prompt_config], sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.is_expired(entry):
+                del self.entries[key]
+                entry = None
+
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self.load(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.disk_hits += 1
+            self.remember(key, entry)
+            return entry
+
+    def put(self, key, sentences, audio=None, marks=None):
+        # `audio` is the PCM of each sentence
+        entry = CachedResponse(sentences, self.clock(), marks=marks)
+        if audio:
+            entry.audio_lengths = [len(pcm) for pcm in audio]
+            audio = b''.join(audio)
+        if self.directory:
+            # Audio stays on disk and is read back on a hit, only the text is kept in memory
+            entry.audio_path = self.store(key, entry, audio)
+            if entry.audio_path is None:
+                entry.audio_lengths = None
+        else:
+            entry.audio = audio
+
+        with self.lock:
+            self.remember(key, entry)
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def is_expired(self, entry):
+        return self.ttl is not None and self.clock() - entry.created > self.ttl
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, f'{key}.{extension}')
+
+    def load(self, key):
+        if not self.directory:
+            return None
+
+        try:
+            with open(self.path(key, 'json')) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        audio_path = self.path(key, 'pcm')
+        entry = CachedResponse(record['sentences'], record['created'], audio_path=audio_path,
+                               audio_lengths=record.get('audio_lengths'), marks=record.get('marks'))
+        if self.is_expired(entry):
+            self.remove(key)
+            return None
+        return entry
+
+    def store(self, key, entry, audio):
+        # A write that fails is skipped, the answer stays cached in memory
+        audio_path = None
+        if audio and self.write_atomic(self.path(key, 'pcm'), audio):
+            audio_path = self.path(key, 'pcm')
+
+        record = json.dumps({
+            'sentences': entry.sentences,
+            'created': entry.created,
+            'audio_lengths': entry.audio_lengths if audio_path else None,
+            'marks': entry.marks,
+        }).encode()
+        if self.write_atomic(self.path(key, 'json'), record):
+            self.evict_disk()
+        return audio_path
+
+    def write_atomic(self, path, data):
+        # A unique temp file: sessions finishing the same question at once store the same key on several threads
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return True
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+    def remove(self, key):
+        for extension in ('json', 'pcm'):
+            try:
+                os.remove(self.path(key, extension))
+            except OSError:
+                pass
+
+    def evict_disk(self):
+        records = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        if len(records) <= self.max_disk_entries:
+            return
+
+        records.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+        for name in records[:len(records) - self.max_disk_entries]:
+            self.remove(name[:-len('.json')])
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': len(self.entries),
+            }
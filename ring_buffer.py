@@ -0,0 +1,120 @@
+import asyncio
+import sys
+import threading
+import timeit
+
+
+class FrameRing:
+    # Fixed-size frames between an audio callback thread (single producer) and the event loop (single consumer).
+    # The buffer is allocated once; the callback copies each frame into its slot, the only copy on the way to
+    # Transcribe, and the consumer gets memoryview slices of the slots. A slot is reused once the consumer asks
+    # for the next frame, so a frame must be fully handled (sent, fed to the VAD) before reading on.
+    # When the consumer falls `capacity` frames behind, new frames are dropped and counted instead of queueing up.
+
+    def __init__(self, frame_bytes, capacity=64):
+        self.frame_bytes = frame_bytes
+        self.capacity = capacity
+        self.buffer = bytearray(frame_bytes * capacity)
+        self.view = memoryview(self.buffer)
+
+        self.written = 0  # Only the producer moves this
+        self.read_count = 0  # Only the consumer moves this
+        self.holding = False  # The consumer still uses the slot at read_count
+        self.dropped = 0
+        self.status_errors = 0
+        self.max_depth = 0
+
+        self.loop = None
+        self.ready = None
+        self.waiting = False
+
+    def attach(self, loop):
+        self.loop = loop
+        self.ready = asyncio.Event()
+
+    def write(self, data, status=None):
+        # Called on the audio thread: no allocation and no logging, it must return well within a frame
+        if status:
+            self.status_errors += 1
+
+        depth = self.written - self.read_count
+        if depth >= self.capacity:
+            self.dropped += 1
+            return
+        if depth + 1 > self.max_depth:
+            self.max_depth = depth + 1
+
+        start = (self.written % self.capacity) * self.frame_bytes
+        self.view[start:start + self.frame_bytes] = data
+        self.written += 1
+
+        if self.waiting:
+            self.waiting = False
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def read(self):
+        # Returns the next frame; the previous one is released back to the producer
+        if self.holding:
+            self.read_count += 1
+            self.holding = False
+
+        while self.written == self.read_count:
+            self.ready.clear()
+            self.waiting = True
+            # Re-checked after announcing the wait, a frame written in between must not be slept through
+            if self.written != self.read_count:
+                self.waiting = False
+                break
+            await self.ready.wait()
+
+        self.holding = True
+        start = (self.read_count % self.capacity) * self.frame_bytes
+        return self.view[start:start + self.frame_bytes]
+
+    def stats(self):
+        return {
+            'frames': self.written,
+            'dropped': self.dropped,
+            'status_errors': self.status_errors,
+            'max_depth': self.max_depth,
+            'capacity': self.capacity,
+        }
+
+
+def benchmark(blocksizes=(256, 512, 1024), number=20000):
+    # Cost per microphone callback on the audio thread: the previous path (copy to a new bytes object, an f-string log
+    # line and an unbounded asyncio queue) against the ring buffer
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+
+    def printer(text, level):
+        # Like the former settings.printer with logging off: the message is still formatted by the caller
+        pass
+
+    for blocksize in blocksizes:
+        frame_bytes = blocksize * 2
+        indata = memoryview(bytearray(frame_bytes))
+        queue = asyncio.Queue()
+
+        def queue_callback():
+            printer(f'[INFO] Audio callback received {len(indata)} bytes, status: {None}', 'info')
+            loop.call_soon_threadsafe(queue.put_nowait, bytes(indata))
+
+        ring = FrameRing(frame_bytes, capacity=number + 1)
+        ring.attach(loop)
+
+        def ring_callback():
+            ring.write(indata)
+
+        queue_us = timeit.timeit(queue_callback, number=number) / number * 1e6
+        ring_us = timeit.timeit(ring_callback, number=number) / number * 1e6
+        frame_ms = blocksize / 16
+        print(f'blocksize {blocksize} ({frame_ms:.0f} ms): queue {queue_us:.2f} us, ring {ring_us:.2f} us per callback, '
+              f'{ring_us / (frame_ms * 10):.4f}% of the frame')
+
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    benchmark(tuple(int(arg) for arg in sys.argv[1:]) or (256, 512, 1024))
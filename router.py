@@ -0,0 +1,131 @@
+import re
+import time
+from collections import deque
+
+from api_request_schema import get_model
+from conversation import estimate_tokens
+from latency import percentile
+from logs import get_logger
+
+log = get_logger('router')
+
+# Cheap features of the final transcript. Chit-chat and short utterances want the fastest answer; questions asking
+# for explanations or comparisons can wait longer for a stronger model.
+CHIT_CHAT = re.compile(r"^(hi|hello|hey|thanks|thank you|ok|okay|good (morning|afternoon|evening|night)|bye|goodbye|"
+                       r"yes|yeah|no|nope|sure|cool|great|nice|awesome|sorry)\b", re.I)
+COMPLEX = re.compile(r"\b(why|explain|compare|comparison|describe|difference|differences|pros and cons|step by step|"
+                     r"walk me through|in detail)\b", re.I)
+
+
+def classify(text, short_words=5, long_words=15):
+    words = len(text.split())
+    if COMPLEX.search(text) or words >= long_words:
+        return 'complex'
+    if CHIT_CHAT.search(text) or words <= short_words:
+        return 'simple'
+    return 'normal'
+
+
+class Route:
+
+    def __init__(self, utterance_class, models, expected_ms, budget_ms):
+        self.utterance_class = utterance_class
+        self.models = models  # The choice first, then the fallbacks when it is throttled
+        self.expected_ms = expected_ms  # Per model
+        self.budget_ms = budget_ms
+
+    def trace(self):
+        # Fields of the turn's latency trace line
+        return {
+            'route': self.utterance_class,
+            'route_expected_ms': round(self.expected_ms[self.models[0]]),
+            'route_budget_ms': self.budget_ms,
+        }
+
+
+class ModelRouter:
+    # Picks the Bedrock model of each turn: the most preferred of `models` whose expected time to the first spoken words
+    # fits the latency budget of the utterance's class, or else the one expected to be fastest. Expectations start from
+    # the catalog's typical time to first token and then follow what was observed, across every session of the process.
+
+    def __init__(self, models, budget_ms, window=50, latency_percentile=90, min_samples=5, first_sentence_tokens=10,
+                 tokens_per_second=50, throttle_penalty=30.0):
+        self.models = list(dict.fromkeys(models))  # Most preferred first
+        for model_id in self.models:
+            if not get_model(model_id).streaming:
+                raise ValueError(f'Model {model_id} cannot stream, it cannot be routed to')
+        self.budget_ms = budget_ms
+        self.latency_percentile = latency_percentile
+        self.min_samples = min_samples
+        self.first_sentence_tokens = first_sentence_tokens
+        self.default_tokens_per_second = tokens_per_second
+        self.throttle_penalty = throttle_penalty
+
+        self.first_token_times = {model_id: deque(maxlen=window) for model_id in self.models}  # Seconds
+        self.tokens_per_second = {model_id: deque(maxlen=window) for model_id in self.models}
+        self.throttled_until = {model_id: 0.0 for model_id in self.models}
+        self.stats = {'turns': 0, 'over_budget': 0, 'fallbacks': 0, 'throttled': 0, 'classes': {}, 'models': {}}
+
+    def expected_ms(self, model_id):
+        first_token_times = self.first_token_times[model_id]
+        if len(first_token_times) >= self.min_samples:
+            first_token = percentile(list(first_token_times), self.latency_percentile)
+        else:
+            first_token = get_model(model_id).first_token_ms / 1000
+        rates = self.tokens_per_second[model_id]
+        rate = percentile(list(rates), 50) if rates else self.default_tokens_per_second
+        return (first_token + self.first_sentence_tokens / rate) * 1000
+
+    def route(self, text):
+        utterance_class = classify(text)
+        budget_ms = self.budget_ms[utterance_class]
+        now = time.monotonic()
+        expected = {model_id: self.expected_ms(model_id) for model_id in self.models}
+
+        # Recently throttled models are only a last resort
+        available = [model_id for model_id in self.models if self.throttled_until[model_id] <= now]
+        throttled = [model_id for model_id in self.models if model_id not in available]
+        fitting = [model_id for model_id in available if expected[model_id] <= budget_ms]
+        if fitting:
+            choice = fitting[0]
+        else:
+            choice = min(available or self.models, key=expected.get)
+        fallbacks = sorted((model_id for model_id in available if model_id != choice), key=expected.get)
+        fallbacks += [model_id for model_id in throttled if model_id != choice]
+        return Route(utterance_class, [choice] + fallbacks, expected, budget_ms)
+
+    def count(self, route, model_id, fallbacks=0):
+        self.stats['turns'] += 1
+        classes = self.stats['classes']
+        classes[route.utterance_class] = classes.get(route.utterance_class, 0) + 1
+        models = self.stats['models']
+        models[model_id] = models.get(model_id, 0) + 1
+        self.stats['fallbacks'] += fallbacks
+        if route.expected_ms[route.models[0]] > route.budget_ms:
+            self.stats['over_budget'] += 1
+        log.info('Routed %s utterance to %s, expected %.0f ms, budget %d ms', route.utterance_class, model_id,
+                 route.expected_ms[model_id], route.budget_ms)
+
+    def throttled(self, model_id):
+        self.stats['throttled'] += 1
+        self.throttled_until[model_id] = time.monotonic() + self.throttle_penalty
+        log.info('%s throttled, avoided for %.0f s', model_id, self.throttle_penalty)
+
+    def observe(self, model_id, requested_at, text_stream):
+        # Returns the measured time to first token in ms, or None; the rate only counts for streams read to the end
+        if text_stream.first_text_at is None:
+            return None
+        first_token = text_stream.first_text_at - requested_at
+        self.first_token_times[model_id].append(first_token)
+
+        rate = None
+        duration = text_stream.last_text_at - text_stream.first_text_at
+        if text_stream.complete and duration > 0:
+            tokens = text_stream.metadata.get('output_tokens') or \
+                estimate_tokens(''.join(text_stream.received), get_model(model_id).family)
+            if tokens > 1:
+                rate = (tokens - 1) / duration
+                self.tokens_per_second[model_id].append(rate)
+        log.info('%s: first token after %.0f ms, %s tokens/s', model_id, first_token * 1000,
+                 'unknown' if rate is None else f'{rate:.0f}')
+        return round(first_token * 1000, 1)
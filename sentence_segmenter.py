@@ -0,0 +1,133 @@
+import time
+
+# Words that end with a period without ending the sentence (compared lowercased, without the trailing period)
+ABBREVIATIONS = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'mt', 'vs', 'etc', 'approx', 'est', 'dept',
+    'inc', 'ltd', 'co', 'corp', 'fig', 'vol', 'ca', 'cf', 'al',
+    'e.g', 'i.e', 'u.s', 'u.k', 'a.m', 'p.m', 'ph.d',
+    'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+}
+# ... only before a number: "No. 5", but "The answer is no. The store..."
+NUMBER_ABBREVIATIONS = {'no'}
+TERMINALS = '.!?'
+CLAUSE_TERMINALS = ':;'
+CLOSERS = '"\')]}'
+
+
+class SentenceSegmenter:
+
+    def __init__(self, first_min_chars=1, min_chars=20, max_chars=250, stall_timeout=0.5, clock=time.monotonic):
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.stall_timeout = stall_timeout
+        self.clock = clock
+
+        self.buffer = ''
+        self.scanned = 0  # Characters of buffer already classified
+        self.soft_break = 0  # End of the last word/comma, used to split over-long or stalled text
+        self.emitted = 0
+        self.last_feed = clock()
+
+    def current_min_chars(self):
+        return self.first_min_chars if self.emitted == 0 else self.min_chars
+
+    def feed(self, text):
+        self.last_feed = self.clock()
+        self.buffer += text
+        segments = []
+
+        # Each character is visited once; a terminal is classified only when the character after it is known
+        i = self.scanned
+        while i < len(self.buffer):
+            char = self.buffer[i]
+
+            if char == '\n':
+                end = i + 1
+            elif char in TERMINALS or char in CLAUSE_TERMINALS:
+                end = self.boundary_end(i)
+                if end is None:
+                    # Need more text to decide, resume from here on the next feed
+                    break
+            else:
+                end = 0
+                if char.isspace():
+                    self.soft_break = i
+                elif char == ',':
+                    self.soft_break = i + 1
+
+            if end and len(self.buffer[:end].strip()) >= self.current_min_chars():
+                segments.append(self.take(end))
+                i = 0
+                continue
+
+            if i + 1 >= self.max_chars and self.soft_break > 0:
+                segments.append(self.take(self.soft_break))
+                i = 0
+                continue
+
+            i += 1
+
+        self.scanned = i
+        return [s for s in segments if s]
+
+    def boundary_end(self, i):
+        # Returns the end index of the sentence if the terminal at i closes one, 0 if it does not,
+        # or None if the following characters have not arrived yet.
+        j = i + 1
+        while j < len(self.buffer) and self.buffer[j] in CLOSERS:
+            j += 1
+        if j >= len(self.buffer):
+            return None
+        if not self.buffer[j].isspace():
+            # "3.5", "e.g.x", "...", "word:value"
+            return 0
+
+        if self.buffer[i] == '.':
+            word_start = max(self.buffer.rfind(' ', 0, i), self.buffer.rfind('\n', 0, i)) + 1
+            word = self.buffer[word_start:i].lstrip('(["\'').lower()
+            if word in ABBREVIATIONS:
+                return 0
+            if word in NUMBER_ABBREVIATIONS:
+                k = j
+                while k < len(self.buffer) and self.buffer[k] == ' ':
+                    k += 1
+                if k >= len(self.buffer):
+                    return None
+                if self.buffer[k].isdigit():
+                    return 0
+            if len(word) == 1 and word.isalpha():
+                # Initials such as "J. R. R. Tolkien"
+                return 0
+        return j
+
+    def take(self, end):
+        segment = self.buffer[:end].strip()
+        self.buffer = self.buffer[end:]
+        self.scanned = 0
+        self.soft_break = 0
+        if segment:
+            self.emitted += 1
+        return segment
+
+    def time_until_flush(self):
+        if not self.buffer.strip():
+            return None
+        return max(0.0, self.last_feed + self.stall_timeout - self.clock())
+
+    def poll(self):
+        # Called when no tokens arrived for stall_timeout seconds: speak what is complete so far,
+        # cut after the last whole word so a half-streamed word is not sent to Polly.
+        if self.time_until_flush() != 0.0:
+            return []
+
+        self.last_feed = self.clock()
+        end = self.soft_break if self.soft_break > 0 else 0
+        if end and len(self.buffer[:end].strip()) >= self.current_min_chars():
+            segment = self.take(end)
+            return [segment] if segment else []
+        return []
+
+    def flush(self):
+        segment = self.take(len(self.buffer))
+        return [segment] if segment else []
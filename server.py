@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from latency import LatencyRecorder
+from logs import close_logging, configure_logging, get_logger
+from session import VoiceSession, create_resources, print_summary
+from settings import check_model_id, config
+
+# Raw TCP protocol: the client streams 16 kHz 16-bit mono PCM from its microphone and receives the answers as PCM
+# in the same format, paced in real time. Closing the connection ends the session.
+
+log = get_logger('server')
+
+
+class SocketSink:
+    # Sends PCM to the client as it would be played, at most `lead` seconds ahead, so an interrupted answer
+    # stops at the client within that time instead of after everything already sent
+
+    def __init__(self, writer, sample_rate=16000, lead=0.2):
+        self.writer = writer
+        self.bytes_per_second = sample_rate * 2
+        self.lead = lead
+        self.played_until = 0.0
+
+    async def write(self, data):
+        now = asyncio.get_running_loop().time()
+        self.played_until = max(self.played_until, now) + len(data) / self.bytes_per_second
+        self.writer.write(data)
+        await self.writer.drain()
+
+        delay = self.played_until - now - self.lead
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def drain(self):
+        delay = self.played_until - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def read_audio(reader, size):
+    while True:
+        try:
+            data = await reader.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            # Whole samples only
+            data = e.partial[:len(e.partial) // 2 * 2]
+            if data:
+                yield data
+            return
+        yield data
+
+
+class VoiceServer:
+
+    def __init__(self, resources, host, port, max_sessions):
+        self.resources = resources
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.session_count = 0
+        # Turns of finished sessions, for the summary at shutdown
+        self.latency = LatencyRecorder()
+
+    async def handle_client(self, reader, writer):
+        if len(self.sessions) >= self.max_sessions:
+            log.info('Session limit reached, refusing connection')
+            writer.close()
+            return
+
+        self.session_count += 1
+        session_id = self.session_count
+        session = VoiceSession(
+            self.resources,
+            SocketSink(writer, config['playback']['sample_rate']),
+            session_id=session_id,
+            echo=False,
+        )
+        self.sessions[session_id] = session
+        log.info('Session %d started, %d active', session_id, len(self.sessions))
+
+        try:
+            await session.run(read_audio(reader, config['mic']['blocksize'] * 2))
+        except ConnectionError:
+            # The client went away mid-answer
+            pass
+        except Exception as e:
+            log.exception('Session %d failed: %s', session_id, e)
+        finally:
+            del self.sessions[session_id]
+            self.latency.history.extend(session.latency.history)
+            writer.close()
+            log.info('Session %d ended, %d active', session_id, len(self.sessions))
+
+    async def start(self):
+        return await asyncio.start_server(self.handle_client, self.host, self.port)
+
+    async def serve(self):
+        # Blocking boto3 calls of all sessions share one bounded pool
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=config['server']['io_workers'], thread_name_prefix='voice-io'))
+        server = await self.start()
+        print(f'[INFO] Listening on {self.host}:{self.port}, up to {self.max_sessions} sessions', flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    check_model_id()
+    configure_logging(config['logging'])
+    resources = create_resources(config['server']['io_workers'])
+    resources.warm()
+    server = VoiceServer(
+        resources,
+        config['server']['host'],
+        config['server']['port'],
+        config['server']['max_sessions'],
+    )
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print()
+    finally:
+        print_summary(server.latency, server.resources)
+        close_logging()
+
+
+if __name__ == '__main__':
+    main()
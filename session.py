@@ -0,0 +1,866 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import deque
+
+from api_request_schema import api_request_list, get_model, get_model_api, limit_tokens
+from audio_cache import AudioCache
+from audio_effects import AudioEffects
+from cancellation import CancellationToken
+from conversation import ConversationStore, estimate_tokens
+from lazy import Lazy, warm
+from latency import LatencyRecorder
+from model_codecs import build_converse_request, get_codec
+from response_cache import ResponseCache, normalize_transcript
+from router import ModelRouter
+from sentence_segmenter import SentenceSegmenter
+from speech_budget import SpeechGovernor, max_tokens_for
+from speech_progress import SpeechProgress, SpokenSentence
+from logs import get_logger
+from settings import config, model_id
+from vad import BargeInDetector, EnergyVad, Endpointer
+from voice_services import RETRYABLE_ERRORS, BedrockStreamer, HedgedStreamer, PollySynthesizer, Speaker
+
+
+bedrock_log = get_logger('bedrock')
+transcribe_log = get_logger('transcribe')
+polly_log = get_logger('polly')
+session_log = get_logger('session')
+
+class SharedResources:
+    # Everything the sessions of one process share: AWS clients with their connection pools, the codec and the caches
+
+    def __init__(self, bedrock_runtime, polly, transcribe, model_codec, audio_cache=None, response_cache=None,
+                 trace_file=None, bedrock_endpoints=(), router=None):
+        self.bedrock_runtime = bedrock_runtime
+        # (client, model_id) pairs to hedge to, after bedrock_runtime with the configured model
+        self.bedrock_endpoints = list(bedrock_endpoints)
+        self.polly = polly
+        self.transcribe = transcribe
+        self.model_codec = model_codec
+        self.audio_cache = audio_cache
+        self.response_cache = response_cache
+        self.trace_file = trace_file
+        self.router = router  # Picks the model of each turn, when set; it learns from the turns of every session
+        self.speculation_stats = {'started': 0, 'used': 0, 'discarded': 0, 'wasted_input_tokens': 0,
+                                  'wasted_output_tokens': 0}
+        self.first_token_times = deque(maxlen=200)
+        self.hedging_stats = {}
+
+    def warm(self):
+        # Transcribe first, it is needed before anything else
+        clients = [self.transcribe, self.bedrock_runtime, self.polly] + [client for client, _ in self.bedrock_endpoints]
+        return warm(*clients)
+
+
+def create_resources(io_workers, bedrock_runtime=None, polly=None, transcribe=None, bedrock_endpoints=None):
+    # Clients that are not passed in (e.g. fakes for a load test) are created for the configured region, on first use
+    # or by SharedResources.warm(); boto3 and amazon_transcribe are only imported then.
+    # Every I/O worker can hold a pooled, kept-alive connection at the same time.
+    boto3_lock = threading.Lock()  # Creating clients from the default boto3 session is not thread-safe
+
+    def boto3_client(service_name, region):
+        def create():
+            import boto3
+            from botocore.config import Config
+            aws_client_config = Config(
+                tcp_keepalive=True,
+                max_pool_connections=io_workers,
+                retries={'max_attempts': 3, 'mode': 'standard'},
+            )
+            with boto3_lock:
+                return boto3.client(service_name=service_name, region_name=region, config=aws_client_config)
+        return Lazy(create)
+
+    def transcribe_client():
+        from amazon_transcribe.client import TranscribeStreamingClient
+        return TranscribeStreamingClient(region=config['region'])
+
+    if bedrock_runtime is None:
+        bedrock_runtime = boto3_client('bedrock-runtime', config['region'])
+    if bedrock_endpoints is None:
+        bedrock_endpoints = []
+        if config['hedging']['enabled']:
+            for endpoint in config['hedging']['endpoints']:
+                bedrock_endpoints.append((boto3_client('bedrock-runtime', endpoint['region']), endpoint.get('model_id')))
+    if polly is None:
+        polly = boto3_client('polly', config['region'])
+    if transcribe is None:
+        transcribe = Lazy(transcribe_client)
+
+    audio_cache = AudioCache(
+        config['audio_cache']['directory'],
+        config['audio_cache']['max_bytes'],
+    ) if config['audio_cache']['enabled'] else None
+    response_cache = ResponseCache(
+        directory=config['response_cache']['directory'],
+        max_entries=config['response_cache']['max_entries'],
+        max_disk_entries=config['response_cache']['max_disk_entries'],
+        ttl=config['response_cache']['ttl'],
+    ) if config['response_cache']['enabled'] else None
+
+    return SharedResources(
+        bedrock_runtime,
+        polly,
+        transcribe,
+        # Resolved once, the per-request and per-chunk paths only call into the codec
+        get_codec(model_id),
+        audio_cache=audio_cache,
+        response_cache=response_cache,
+        trace_file=config['latency_trace_file'],
+        bedrock_endpoints=bedrock_endpoints,
+        router=create_router(),
+    )
+
+
+def create_router():
+    routing = config['router']
+    if not routing['enabled']:
+        return None
+    return ModelRouter(
+        routing['models'],
+        routing['budget_ms'],
+        window=routing['window'],
+        latency_percentile=routing['percentile'],
+        min_samples=routing['min_samples'],
+        first_sentence_tokens=routing['first_sentence_tokens'],
+        tokens_per_second=routing['tokens_per_second'],
+        throttle_penalty=routing['throttle_penalty'],
+    )
+
+
+def print_summary(latency, resources):
+    summary = latency.format_summary()
+    if summary:
+        print(summary, flush=True)
+    if resources.response_cache:
+        print(f'[CACHE] Response cache: {resources.response_cache.stats()}', flush=True)
+    if resources.audio_cache:
+        print(f'[CACHE] Audio cache: {resources.audio_cache.stats()}', flush=True)
+    if resources.hedging_stats:
+        print(f'[HEDGING] {resources.hedging_stats}', flush=True)
+    if resources.router and resources.router.stats['turns']:
+        print(f'[ROUTER] {resources.router.stats}', flush=True)
+    stats = resources.speculation_stats
+    if stats['started']:
+        print(f"[SPECULATION] {stats['started']} requests, {stats['used']} used "
+              f"(hit rate {stats['used'] / stats['started']:.3f}), ~{stats['wasted_input_tokens']} input and "
+              f"~{stats['wasted_output_tokens']} output tokens wasted", flush=True)
+
+
+def create_effects():
+    # One per session, it keeps the loudness it follows from answer to answer
+    effects = config['effects']
+    if not effects['enabled']:
+        return None
+    return AudioEffects(
+        config['polly']['SampleRate'],
+        config['playback']['sample_rate'],
+        time_stretch=effects['time_stretch'],
+        normalize=effects['normalize'],
+        target_dbfs=effects['target_dbfs'],
+        max_gain_db=effects['max_gain_db'],
+        frame_ms=effects['frame_ms'],
+        search_ms=effects['search_ms'],
+    )
+
+
+def prewarm_audio_cache(synthesizer):
+    effects = config['effects']
+    for text, speech_rate in [(config['last_speech'], None)] + config['audio_cache']['prewarm']:
+        if effects['enabled'] and effects['time_stretch']:
+            speech_rate = None  # Applied at playback
+        try:
+            stream = synthesizer.synthesize(text, speech_rate)
+            while stream.read(4096):
+                pass
+            stream.close()
+        except Exception as e:
+            polly_log.info('Could not pre-warm audio cache: %s', e)
+
+
+def spoken_sentences(cached, audio, speech_rate):
+    # The sentences of a cached answer with their stored PCM and speech marks
+    sentences = []
+    offset = 0
+    marks = cached.marks or [None] * len(cached.sentences)
+    for text, length, sentence_marks in zip(cached.sentences, cached.audio_lengths, marks):
+        sentence = SpokenSentence(text, config['polly']['SampleRate'], speech_rate,
+                                  [tuple(mark) for mark in sentence_marks] if sentence_marks else None)
+        sentence.pcm = bytearray(audio[offset:offset + length])
+        sentence.complete = True
+        offset += length
+        sentences.append(sentence)
+    return sentences
+
+
+def split_polly_text(polly_text, max_chars=1500):
+    # The first sentence goes out on its own so playback can start early, the rest is packed up to
+    # max_chars per request (Polly accepts up to 3000 billed characters per synthesize_speech call).
+    sentences = [s for s in re.split(r'(?<=[.!?])\s+', polly_text.strip()) if s]
+    chunks = sentences[:1]
+    for sentence in sentences[1:]:
+        if len(chunks) > 1 and len(chunks[-1]) + len(sentence) + 1 <= max_chars:
+            chunks[-1] = f'{chunks[-1]} {sentence}'
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+async def collect(items, into):
+    async for item in items:
+        into.append(item)
+        yield item
+
+
+class BedrockModelsWrapper:
+
+    @staticmethod
+    def define_body(codec, api_request, text, conversation):
+        return codec.build_body(
+            api_request['body'],
+            text,
+            config['bedrock']['system_prompt'],
+            conversation.history(),
+            conversation.summary(),
+        )
+
+    @staticmethod
+    def define_converse_request(api_request, text, conversation):
+        return build_converse_request(
+            api_request,
+            text,
+            config['bedrock']['system_prompt'],
+            conversation.history(),
+            conversation.summary(),
+        )
+
+    @staticmethod
+    def get_stream_chunk(event):
+        return event.get('chunk')
+
+    @staticmethod
+    def get_stream_text(codec, chunk):
+        payload = chunk.get('bytes')
+        bedrock_log.debug('Chunk bytes: %s', payload)
+        return codec.decode(payload)
+
+
+def speaking_budget():
+    # Seconds an answer may take to speak, None when unbounded
+    budget = config['speech_budget']
+    return budget['max_seconds'] if budget['enabled'] else None
+
+
+def token_budget():
+    # Output tokens an answer needs at most, None when unbounded
+    seconds = speaking_budget()
+    if seconds is None:
+        return None
+    budget = config['speech_budget']
+    return max_tokens_for(seconds, config['polly']['SpeechRate'], budget['words_per_minute'],
+                          budget['token_margin'])
+
+
+def prompt_tokens(text, conversation, family):
+    # Estimated input tokens of a request for `text`, without the per-family prompt markup
+    turns = ' '.join(f'{user} {assistant}' for user, assistant in conversation.history())
+    prompt = ' '.join([config['bedrock']['system_prompt'], conversation.summary(), turns, text])
+    return estimate_tokens(prompt, family)
+
+
+async def to_sentences(text_stream, session, governor=None):
+    segmenter = SentenceSegmenter(**config['segmenter'])
+
+    while True:
+        try:
+            # Wakes up when tokens stall, so the complete words so far can be spoken
+            text = await text_stream.next(segmenter.time_until_flush())
+        except StopAsyncIteration:
+            break
+
+        if text is None:
+            sentences = segmenter.poll()
+        else:
+            session.latency.mark('first_token')
+            sentences = segmenter.feed(text)
+
+        for sentence in sentences:
+            session.show(sentence)
+            session.latency.mark('first_sentence')
+            yield sentence
+            if governor is not None and governor.add(sentence):
+                # Long enough to listen to: the rest is not generated, and the unfinished sentence is not read
+                text_stream.close()
+                session.show('\n', end='\n')
+                return
+
+    for sentence in segmenter.flush():
+        session.show(sentence, end='')
+        session.latency.mark('first_sentence')
+        yield sentence
+
+    session.show('\n', end='\n')
+
+
+class Speculation:
+    # A Bedrock request started on a stable partial transcript. Its tokens wait unread in the text stream
+    # until the turn ends with the same words, or the request is discarded.
+
+    def __init__(self, key, model_id=None):
+        self.key = key
+        self.task = None
+        self.model_id = model_id  # None for the configured model
+        self.prompt_tokens = 0  # Estimated, set when the request is sent
+
+
+class BedrockWrapper:
+
+    def __init__(self, session):
+        self.session = session
+        self.speaking = False
+        self.token = None
+        self.tasks = set()
+        self.speculation = None
+        self.interrupted = None  # SpeechProgress of the answer interrupted last turn, when it can be resumed
+
+    def is_speaking(self):
+        return self.speaking
+
+    def start_turn(self, text, token):
+        # Called on the event loop, so no transcript slips in between the end of the turn and speaking
+        self.token = token
+        self.speaking = True
+
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(self.invoke_bedrock(text, token))
+        # ENTER cancels from the input thread and barge-in from the loop, either way the task is cancelled on the loop
+        token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def interrupt(self, reason):
+        token = self.token
+        if token is not None and not token.cancelled:
+            token.cancel(reason)
+            # The user is talking over the answer, their words must be transcribed from now on
+            self.speaking = False
+
+    async def close(self):
+        self.interrupt('session closed')
+        self.discard_speculation()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def speculate(self, text):
+        key = normalize_transcript(text)
+        if self.speculation is not None:
+            if self.speculation.key == key:
+                return
+            self.discard_speculation()
+
+        bedrock_log.debug('Speculating on: %s', text)
+        router = self.session.resources.router
+        model_id = router.route(text).models[0] if router else None
+        speculation = Speculation(key, model_id)
+        speculation.task = asyncio.get_running_loop().create_task(self.open_stream(text, model_id, speculation))
+        self.speculation = speculation
+        self.session.resources.speculation_stats['started'] += 1
+
+    def take_speculation(self, text):
+        # Only a request made for the words the turn ended with can answer it
+        speculation, self.speculation = self.speculation, None
+        if speculation is None:
+            return None
+        if speculation.key != normalize_transcript(text):
+            self.discard(speculation)
+            return None
+
+        self.session.resources.speculation_stats['used'] += 1
+        return speculation
+
+    def discard_speculation(self):
+        speculation, self.speculation = self.speculation, None
+        if speculation is not None:
+            self.discard(speculation)
+
+    def discard(self, speculation):
+        # The prompt of a request that was sent is billed even when it is cancelled before its stream opens
+        stats = self.session.resources.speculation_stats
+        family = get_model(self.request_for(speculation.model_id)['modelId']).family
+        stats['discarded'] += 1
+
+        def close(task):
+            if task.cancelled() or task.exception() is not None:
+                stats['wasted_input_tokens'] += speculation.prompt_tokens
+                return
+            text_stream = task.result()
+            text_stream.close()
+            received = ''.join(text_stream.received)
+            stats['wasted_input_tokens'] += text_stream.metadata.get('input_tokens') or speculation.prompt_tokens
+            stats['wasted_output_tokens'] += text_stream.metadata.get('output_tokens') or \
+                (estimate_tokens(received, family) if received else 0)
+
+        speculation.task.cancel()
+        speculation.task.add_done_callback(close)
+
+    async def invoke_bedrock(self, text, token):
+        bedrock_log.debug('Bedrock generation started')
+        session = self.session
+        response_cache = session.resources.response_cache
+        loop = asyncio.get_running_loop()
+        answer = []
+        stats = {}  # Model, route, token usage and service-side latency, when known
+        cache_key = None
+        cached = None
+        progress = None
+        if config['progress']['enabled']:
+            progress = SpeechProgress(config['polly']['SampleRate'],
+                                      session.speaker.synthesis_rate(config['polly']['SpeechRate']))
+        # Only the turn right after an interrupted answer can resume it
+        interrupted, self.interrupted = self.interrupted, None
+        if interrupted and normalize_transcript(text) not in config['progress']['resume_phrases']:
+            interrupted = None
+        router = session.resources.router
+        route = router.route(text) if router and not interrupted else None
+        api_request = self.request_for(route.models[0] if route else None)
+
+        try:
+            if response_cache and not interrupted:
+                cache_key = self.response_key(text, api_request['modelId'])
+                cached = await loop.run_in_executor(None, response_cache.get, cache_key)
+
+            if interrupted:
+                self.discard_speculation()
+                stats['resumed'] = True
+                await self.resume(interrupted, answer, progress)
+            elif cached:
+                bedrock_log.debug('Replaying cached response')
+                self.discard_speculation()
+                answer.extend(cached.sentences)
+                await self.replay(cached, progress)
+            else:
+                await self.generate(text, cache_key, answer, stats, self.take_speculation(text), route, progress)
+
+            # Let the tail of the answer fade out before the microphone is listened to again
+            await asyncio.sleep(1)
+
+        except asyncio.CancelledError:
+            if not token.cancelled:
+                # Shutting down, not an interrupt
+                raise
+        except Exception:
+            bedrock_log.exception('Session %d: turn failed', session.session_id)
+
+        finally:
+            # Interrupted answers are kept too: with progress tracking up to the word that was cut off, or else up to
+            # the sentence that was being read
+            heard = ' '.join(answer)
+            if progress is not None and progress.sentences and token.cancelled:
+                heard = progress.heard_text()
+                self.interrupted = progress
+                stats['heard_chars'] = len(heard)
+            stats.setdefault('model_id', api_request['modelId'])
+            session.conversation.add_turn(text, heard, get_model(stats['model_id']).family)
+            if route:
+                stats.update(route.trace())
+            session.latency.end_turn(
+                session=session.session_id,
+                cached=cached is not None,
+                cancelled=token.reason,
+                **stats,
+            )
+            if self.token is token:
+                self.speaking = False
+            bedrock_log.debug('Bedrock generation completed')
+
+    def response_key(self, text, model_id):
+        # Everything a cached answer depends on. The conversation so far too: a follow-up such as "and the second
+        # one?" means something else in another context. Stored audio also depends on the voice and the rate it was
+        # synthesized at, which is none with time stretching.
+        conversation = self.session.conversation
+        api_request = self.request_for(model_id)
+        audio = None
+        if config['response_cache']['store_audio']:
+            polly = config['polly']
+            audio = [polly['VoiceId'], polly['Engine'], polly['SampleRate'],
+                     self.session.speaker.synthesis_rate(config['polly']['SpeechRate'])]
+        return ResponseCache.key(
+            text,
+            api_request['modelId'],
+            [config['bedrock']['system_prompt'], api_request['body'], conversation.history(), conversation.summary(),
+             audio],
+        )
+
+    @staticmethod
+    def request_for(model_id):
+        # The configured request, or the catalog's for a model the router picked
+        api_request = config['bedrock']['api_request']
+        if model_id is None or model_id == api_request['modelId']:
+            return api_request
+        return api_request_list[model_id]
+
+    async def open_stream(self, text, model_id=None, speculation=None):
+        session = self.session
+        api_request = self.request_for(model_id)
+        max_tokens = token_budget()
+        if speculation is not None:
+            speculation.prompt_tokens = prompt_tokens(text, session.conversation,
+                                                      get_model(api_request['modelId']).family)
+        if get_model_api(api_request['modelId']) == 'converse':
+            request = BedrockModelsWrapper.define_converse_request(api_request, text, session.conversation)
+            if max_tokens:
+                inference = request['inferenceConfig']
+                inference['maxTokens'] = min(inference.get('maxTokens', max_tokens), max_tokens)
+            bedrock_log.debug('Converse request: %s', request)
+            return await session.streamer.converse(request)
+
+        codec = session.resources.model_codec
+        if api_request is not config['bedrock']['api_request']:
+            codec = get_codec(api_request['modelId'])
+        body = BedrockModelsWrapper.define_body(codec, api_request, text, session.conversation)
+        if max_tokens:
+            limit_tokens(body, get_model(api_request['modelId']).max_tokens_field, max_tokens)
+        bedrock_log.debug('Request body: %s', body)
+        return await session.streamer.stream(
+            api_request,
+            json.dumps(body),
+            lambda chunk: BedrockModelsWrapper.get_stream_text(codec, chunk),
+        )
+
+    async def open_routed(self, text, route, stats):
+        # Tries the models of the route in order while they are throttled (after the streamer's own retries).
+        # Returns the stream, its model and when it was requested.
+        from botocore.exceptions import ClientError  # Loaded with the clients by now
+        router = self.session.resources.router
+        for i, model_id in enumerate(route.models):
+            requested_at = time.monotonic()
+            text_stream = None
+            try:
+                text_stream = await self.open_stream(text, model_id)
+                # Throttling can also be reported as the first event of the stream
+                await text_stream.peek()
+            except ClientError as e:
+                if text_stream is not None:
+                    text_stream.close()
+                if e.response.get('Error', {}).get('Code') not in RETRYABLE_ERRORS:
+                    raise
+                router.throttled(model_id)
+                if i == len(route.models) - 1:
+                    raise
+                continue
+            except BaseException:
+                if text_stream is not None:
+                    text_stream.close()
+                raise
+            router.count(route, model_id, fallbacks=i)
+            if i:
+                stats['fallbacks'] = i
+            return text_stream, model_id, requested_at
+
+    async def generate(self, text, cache_key, answer, stats, speculation=None, route=None, progress=None):
+        session = self.session
+        router = session.resources.router
+        requested_at = None
+        if speculation is not None:
+            # Started while the user was finishing the sentence, its first tokens may already be waiting
+            stats['speculative'] = True
+            text_stream = await speculation.task
+            model_id = speculation.model_id
+            if route:
+                router.count(route, model_id)
+        elif route:
+            text_stream, model_id, requested_at = await self.open_routed(text, route, stats)
+        else:
+            text_stream = await self.open_stream(text)
+            model_id = None
+        stats['model_id'] = self.request_for(model_id)['modelId']
+        bedrock_log.debug('Capturing Bedrocks response/bedrock_stream')
+
+        speech_rate = config['polly']['SpeechRate']
+        governor = None
+        seconds = speaking_budget()
+        if seconds is not None:
+            governor = SpeechGovernor(seconds, speech_rate, config['speech_budget']['words_per_minute'])
+        capture = [] if cache_key and config['response_cache']['store_audio'] else None
+        try:
+            await session.speaker.speak(collect(to_sentences(text_stream, session, governor), answer),
+                                        speech_rate=speech_rate, capture=capture, progress=progress)
+        finally:
+            # Unblocks the stream reader when the turn was cancelled mid-answer
+            text_stream.close()
+            stats.update(text_stream.metadata)
+            # A speculative request was made before the end of the turn, its timing says nothing about the model
+            if requested_at is not None:
+                stats['model_first_token_ms'] = router.observe(model_id, requested_at, text_stream)
+            if governor is not None:
+                stats['speech_budget_s'] = governor.max_seconds
+                stats['spoken_s'] = round(governor.seconds, 1)
+                stats['stopped_early'] = governor.stopped
+
+        # Only answers that were generated and played to the end are cached, under the model that answered: a
+        # speculation or a throttled route may not be the model the cache was looked up for
+        if cache_key and answer:
+            marks = [sentence.marks for sentence in progress.sentences] if progress is not None else None
+            await asyncio.get_running_loop().run_in_executor(
+                None, session.resources.response_cache.put, self.response_key(text, stats['model_id']), answer,
+                [bytes(pcm) for pcm in capture] if capture else None, marks)
+
+    async def replay(self, cached, progress=None):
+        session = self.session
+        session.show(' '.join(cached.sentences), end='\n')
+        session.latency.mark('first_sentence')
+
+        speech_rate = config['polly']['SpeechRate']
+        items = cached.sentences
+        if config['response_cache']['store_audio'] and cached.audio_lengths:
+            audio = await asyncio.get_running_loop().run_in_executor(None, cached.load_audio)
+            if audio:
+                # Sentence by sentence, so an interrupted replay knows what was heard and can be resumed
+                items = spoken_sentences(cached, audio, session.speaker.synthesis_rate(speech_rate))
+
+        await session.speaker.speak(iterate(items), speech_rate=speech_rate, progress=progress)
+
+    async def resume(self, interrupted, answer, progress=None):
+        # Plays what was not heard of an interrupted answer: the sentence that was cut off from the start of its word,
+        # from the audio already synthesized, then the sentences after it
+        await interrupted.settled()
+        items = interrupted.remainder()
+        answer.extend(item.text if isinstance(item, SpokenSentence) else item for item in items)
+        self.session.show(' '.join(answer), end='\n')
+        self.session.latency.mark('first_sentence')
+        await self.session.speaker.speak(iterate(items), speech_rate=config['polly']['SpeechRate'],
+                                         progress=progress)
+
+
+class EventHandler:
+    max_sample_counter = 4
+
+    def __init__(self, transcript_result_stream, session):
+        self.transcript_result_stream = transcript_result_stream
+        self.session = session
+        self.bedrock_wrapper = session.bedrock_wrapper
+        self.text = []
+        self.sample_count = 0
+        self.partial = None  # (result_id, transcript) of the latest partial result
+        self.committed_result_ids = set()
+        self.candidate = ''  # Normalized transcript so far, and since when it has not changed
+        self.candidate_since = 0.0
+
+        barge_in = config['barge_in']
+        self.barge_in = BargeInDetector(
+            sample_rate=config['mic']['sample_rate'],
+            frame_ms=config['endpointing']['frame_ms'],
+            echo_margin_db=barge_in['echo_margin_db'],
+            min_speech_ms=barge_in['min_speech_ms'],
+            playback_margin_db=barge_in['playback_margin_db'],
+        ) if barge_in['enabled'] else None
+
+        endpointing = config['endpointing']
+        self.vad = EnergyVad(sample_rate=config['mic']['sample_rate'], frame_ms=endpointing['frame_ms'],
+                             margin_db=endpointing['margin_db']) \
+            if endpointing['vad'] else None
+        self.endpointer = Endpointer(
+            frame_ms=endpointing['frame_ms'],
+            silence_ms=endpointing['silence_ms'],
+            final_silence_ms=endpointing['final_silence_ms'],
+            max_silence_ms=endpointing['max_silence_ms'],
+        )
+
+    async def handle_events(self):
+        # As amazon_transcribe's TranscriptResultStreamHandler; its model module is loaded with the client by now
+        from amazon_transcribe.model import TranscriptEvent
+        async for event in self.transcript_result_stream:
+            if isinstance(event, TranscriptEvent):
+                await self.handle_transcript_event(event)
+
+    async def handle_transcript_event(self, transcript_event):
+        results = transcript_event.transcript.results
+        transcribe_log.info('Received transcript event. Results: %d', len(results) if results else 0)
+
+        if not self.bedrock_wrapper.is_speaking():
+
+            if results:
+                for result in results:
+                    self.sample_count = 0
+                    if result.result_id in self.committed_result_ids:
+                        # Late result of a segment already sent to Bedrock from its partial transcript
+                        if not result.is_partial:
+                            self.committed_result_ids.discard(result.result_id)
+                        continue
+
+                    self.endpointer.on_result(result.is_partial)
+                    if result.is_partial:
+                        if result.alternatives:
+                            self.partial = (result.result_id, result.alternatives[0].transcript)
+                    else:
+                        self.partial = None
+                        for alt in result.alternatives:
+                            transcribe_log.info('Transcribed: %s', alt.transcript)
+                            self.session.show(alt.transcript)
+                            self.text.append(alt.transcript)
+
+            else:
+                self.sample_count += 1
+                transcribe_log.info('Empty transcript result #%d', self.sample_count)
+                if self.sample_count == EventHandler.max_sample_counter:
+
+                    if len(self.text) == 0 and self.partial is None:
+                        transcribe_log.info('No speech detected after timeout, exiting...')
+                        await self.session.say_goodbye()
+                    elif self.vad is None or not self.endpointer.speech_seen:
+                        # Also when the VAD never heard the words Transcribe returned, so the turn cannot get stuck
+                        self.commit_turn()
+
+                    self.sample_count = 0
+
+    def on_audio(self, chunk):
+        speaking = self.bedrock_wrapper.is_speaking()
+        if self.barge_in and self.barge_in.process(chunk, armed=speaking,
+                                                   playback_dbfs=self.session.speaker.level.current()):
+            session_log.info('User started speaking, interrupting the answer')
+            self.bedrock_wrapper.interrupt('barge-in')
+            speaking = False
+
+        if not speaking:
+            self.maybe_speculate()
+
+        if self.vad is None:
+            return
+
+        speech = self.vad.process(chunk)
+        if speaking:
+            # Playback is picked up by the microphone, it must not count as the user speaking
+            self.endpointer.reset()
+            return
+
+        self.endpointer.on_frames(speech)
+        if (self.text or self.partial) and self.endpointer.should_commit():
+            self.commit_turn()
+
+    def maybe_speculate(self):
+        if not config['speculation']['enabled'] or self.bedrock_wrapper.tasks:
+            return
+
+        words = self.text + [self.partial[1]] if self.partial else self.text
+        candidate = normalize_transcript(' '.join(words))
+        now = time.monotonic()
+        if candidate != self.candidate:
+            # The user is still talking, a request for the earlier words would be wasted
+            self.candidate = candidate
+            self.candidate_since = now
+            self.bedrock_wrapper.discard_speculation()
+        elif candidate and now - self.candidate_since >= config['speculation']['stable_ms'] / 1000:
+            self.bedrock_wrapper.speculate(' '.join(words))
+
+    def commit_turn(self):
+        text = list(self.text)
+        if self.partial is not None:
+            # Transcribe has not finalized the last segment yet, its partial transcript is good enough to start with
+            result_id, transcript = self.partial
+            self.committed_result_ids.add(result_id)
+            self.session.show(transcript)
+            text.append(transcript)
+
+        self.text.clear()
+        self.sample_count = 0
+        self.partial = None
+        self.candidate = ''
+        self.endpointer.reset()
+
+        input_text = ' '.join(text)
+        session_log.info('User input: %s', input_text)
+        self.session.latency.start_turn()
+        self.session.latency.mark('end_of_speech')
+
+        # The token lets ENTER or barge-in cancel the turn: Bedrock stream, pending Polly requests and playback
+        self.bedrock_wrapper.start_turn(input_text, CancellationToken())
+
+
+class VoiceSession:
+    # One conversation: its own transcription stream, history, endpointing and latency trace, speaking into `sink`
+    # (anything with async write/drain). The AWS clients and caches come from the shared resources.
+
+    def __init__(self, resources, sink, session_id=1, echo=True):
+        self.resources = resources
+        self.session_id = session_id
+        self.echo = echo  # Print the transcripts and answers, only wanted when a single user sits at the console
+
+        self.latency = LatencyRecorder(resources.trace_file)
+        self.conversation = ConversationStore(resources.model_codec.family, **config['conversation'])
+        # With the configured endpoint alone (hedging off), throttling is still retried with backoff
+        hedging = config['hedging']
+        self.streamer = HedgedStreamer(
+            [BedrockStreamer(resources.bedrock_runtime, self.latency)] + [
+                BedrockStreamer(client, self.latency, endpoint_model_id, config['bedrock']['api_request']['modelId'])
+                for client, endpoint_model_id in resources.bedrock_endpoints
+            ],
+            first_token_times=resources.first_token_times,
+            hedge_after=hedging['hedge_after'],
+            hedge_percentile=hedging['percentile'],
+            min_samples=hedging['min_samples'],
+            max_attempts=hedging['max_attempts'],
+            backoff=hedging['backoff'],
+            stats=resources.hedging_stats,
+        )
+        self.synthesizer = PollySynthesizer(resources.polly, config['polly'], resources.audio_cache, self.latency)
+        self.speaker = Speaker(self.synthesizer, sink, lookahead=config['playback']['lookahead'], latency=self.latency,
+                               effects=create_effects())
+        self.bedrock_wrapper = BedrockWrapper(self)
+        self.finished = asyncio.Event()
+
+    def show(self, text, end=' '):
+        if self.echo:
+            print(text, flush=True, end=end)
+
+    async def say_goodbye(self):
+        last_speech = config['last_speech']
+        self.show(last_speech, end='\n')
+        polly_log.debug('Character count: %d', len(last_speech))
+        # Chunks are synthesized concurrently and each one is played as soon as its audio arrives
+        await self.speaker.speak(iterate(split_polly_text(last_speech)), speech_rate=None)
+        self.finished.set()
+
+    async def write_chunks(self, stream, handler, audio_chunks):
+        transcribe_log.info('Starting to write audio chunks to Transcribe...')
+        async for chunk in audio_chunks:
+            try:
+                await stream.input_stream.send_audio_event(audio_chunk=chunk)
+            except Exception as e:
+                transcribe_log.info('Error sending audio chunk: %s', e)
+                raise
+            handler.on_audio(chunk)
+
+        await stream.input_stream.end_stream()
+
+    async def run(self, audio_chunks):
+        # Returns when the input ends, the transcription stream closes or the user stayed silent and was told goodbye
+        transcribe_log.info('Session %d: connecting to Amazon Transcribe...', self.session_id)
+        stream = await self.resources.transcribe.start_stream_transcription(
+            language_code="en-US",
+            media_sample_rate_hz=config['mic']['sample_rate'],
+            media_encoding="pcm",
+        )
+        transcribe_log.info('Session %d: connected to Amazon Transcribe', self.session_id)
+
+        handler = EventHandler(stream.output_stream, self)
+        loop = asyncio.get_running_loop()
+        tasks = [
+            loop.create_task(self.write_chunks(stream, handler, audio_chunks)),
+            loop.create_task(handler.handle_events()),
+            loop.create_task(self.finished.wait()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.bedrock_wrapper.close()
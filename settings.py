@@ -0,0 +1,164 @@
+import os
+import sys
+
+from api_request_schema import api_request_list, get_model, get_model_ids
+
+model_id = os.getenv('MODEL_ID', 'us.anthropic.claude-sonnet-4-20250514-v1:0')
+aws_region = os.getenv('AWS_REGION', 'us-east-1')
+
+api_request = api_request_list.get(model_id)
+config = {
+    'logging': {
+        'level': os.getenv('LOG_LEVEL', 'none'),  # none, info or debug
+        'components': {},  # Per component overrides, e.g. {'bedrock': 'debug'}; see logs.COMPONENTS
+        'console': True,
+        'json_file': os.getenv('LOG_JSON_FILE', ''),  # JSON lines written by a background thread; empty disables it
+        'ring_size': 10000,  # Records queued for the JSON file before the oldest are dropped
+    },
+    'io_workers': 8,  # Shared thread pool for the blocking boto3 calls, used by every turn
+    'latency_trace_file': os.getenv('LATENCY_TRACE_FILE', 'latency_trace.jsonl'),  # Empty string disables the trace
+    'last_speech': "If you have any other questions, please don't hesitate to ask. Have a great day!",
+    'region': aws_region,
+    'polly': {
+        'Engine': 'neural',
+        'LanguageCode': 'en-US',
+        'VoiceId': 'Joanna',
+        'OutputFormat': 'pcm',
+        'SpeechMarkTypes': ['word'],  # Requested alongside the audio when config['progress'] is enabled
+        'SampleRate': '16000',
+        'SpeechRate': '150%',  # SSML prosody rate the answers are read at, and their spoken length is estimated at
+    },
+    'mic': {
+        'sample_rate': 16000,  # Also the rate the audio is streamed to Transcribe at
+        'blocksize': 512,  # Frames per microphone callback, 32 ms at 16 kHz
+        'ring_frames': 64,  # Blocks buffered for the event loop before new ones are dropped, ~2 s at 512
+    },
+    'barge_in': {
+        'enabled': True,  # Speaking over the answer interrupts it
+        'echo_margin_db': 18.0,  # Speech must be this much louder than the room noise
+        # ... and louder at the microphone than the level of the audio being played plus this, so the answer's own echo
+        # does not interrupt it; raise it for loud speakers close to the microphone
+        'playback_margin_db': -6.0,
+        'min_speech_ms': 120,
+    },
+    'endpointing': {
+        'vad': True,  # Local voice activity detection decides the end of a turn, instead of counting empty transcripts
+        'frame_ms': 20,
+        'margin_db': 10.0,  # Speech must be this much louder than the tracked noise floor
+        'silence_ms': 600,  # Silence that ends a turn, stretched up to max_silence_ms for users who pause a lot
+        'max_silence_ms': 1500,
+        'final_silence_ms': 250,  # Shorter window once Transcribe returned a final (non-partial) result
+    },
+    'speculation': {
+        'enabled': False,  # Start the Bedrock request before the end of the turn, on a partial transcript
+        'stable_ms': 300,  # How long the transcript must stay unchanged before speculating on it
+    },
+    'hedging': {
+        'enabled': False,  # Race Bedrock requests over the endpoints below when the first token is late
+        # Asked after the configured region and model, in this order. Each has a 'region' and optionally a 'model_id',
+        # e.g. a cross-region inference profile
+        'endpoints': [
+            {'region': 'us-west-2'},
+        ],
+        'hedge_after': 1.5,  # Seconds to wait for the first token before hedging, until min_samples requests were seen
+        'percentile': 95,  # Then the deadline is this percentile of the recent times to first token
+        'min_samples': 20,
+        'max_attempts': 3,  # Per endpoint, when throttled; also without hedging
+        'backoff': 0.2,  # Seconds before the first retry, doubled for each further one
+    },
+    'router': {
+        'enabled': False,  # Pick the model of each turn among `models` instead of always using MODEL_ID
+        'models': [model_id, 'us.anthropic.claude-3-5-haiku-20241022-v1:0'],  # Most preferred first
+        # Expected time from the request to the first spoken words, per kind of utterance: the most preferred model
+        # expected to meet it is used, or else the fastest
+        'budget_ms': {'simple': 700, 'normal': 1000, 'complex': 1800},
+        'window': 50,  # Recent turns per model the expectation is based on
+        'percentile': 90,  # Of the recent times to first token
+        'min_samples': 5,  # Until then the catalog's typical time to first token is used
+        'first_sentence_tokens': 10,
+        'tokens_per_second': 50,  # Assumed until a model was observed
+        'throttle_penalty': 30,  # Seconds a throttled model is only used as a fallback
+    },
+    'progress': {
+        'enabled': False,  # Keep only the heard part of interrupted answers in the conversation, and let them be resumed
+        # Transcripts (normalized, see response_cache.normalize_transcript) that resume the answer interrupted last turn
+        'resume_phrases': ['continue', 'go on', 'keep going', 'carry on', 'please continue'],
+    },
+    'speech_budget': {
+        'enabled': True,  # Cap and stop generation once the answer is long enough to listen to
+        # Longest answer to speak in one turn, in seconds at the Polly SpeechRate. The same for every question: a short
+        # one such as "tell me a story" can ask for a long answer
+        'max_seconds': 60,
+        'words_per_minute': 160,  # Polly at the voice's own rate
+        'token_margin': 1.5,  # max_tokens leaves this much room, so the stop can wait for the end of a sentence
+    },
+    'conversation': {
+        'token_budget': 2000,  # Approximate tokens of previous turns sent with each request
+        'summarize': True,  # Keep a one-line summary of turns trimmed from the history
+        'summary_tokens': 200,
+    },
+    'response_cache': {
+        'enabled': True,
+        'directory': os.path.join('.cache', 'responses'),  # On-disk tier, None keeps the cache in memory only
+        'max_entries': 128,
+        'max_disk_entries': 1024,
+        'ttl': 24 * 3600,  # Seconds
+        'store_audio': True,  # Replay the recorded PCM instead of synthesizing the answer again
+    },
+    'audio_cache': {
+        'enabled': True,
+        'directory': os.path.join('.cache', 'audio'),
+        'max_bytes': 64 * 1024 * 1024,
+        # Synthesized in the background at startup together with last_speech, as (text, SSML speech rate) pairs
+        'prewarm': [
+            ('Sure!', '150%'),
+            ('Of course!', '150%'),
+        ],
+    },
+    'segmenter': {
+        'first_min_chars': 1,  # The first fragment is spoken as soon as it is complete
+        'min_chars': 20,  # Shorter sentences are merged with the next one
+        'max_chars': 250,  # Longer runs without punctuation are split after a word or comma
+        'stall_timeout': 0.5,  # Seconds without tokens before the complete words so far are spoken
+    },
+    'server': {
+        'host': os.getenv('VOICE_SERVER_HOST', '127.0.0.1'),
+        'port': int(os.getenv('VOICE_SERVER_PORT', '8765')),
+        'max_sessions': 32,  # Further connections are refused
+        'io_workers': 64,  # Every session streaming an answer holds one worker for its Bedrock stream
+    },
+    'playback': {
+        'lookahead': 2,  # Sentences synthesized ahead of the one currently playing
+        'sample_rate': 16000,  # Of the output device; other than Polly's SampleRate it needs config['effects']
+        'frames_per_buffer': 1024,
+    },
+    'effects': {
+        'enabled': False,  # Process Polly's audio before the device, see audio_effects.py
+        'time_stretch': True,  # Apply the speech rate at playback; type + or - and ENTER to change the speed
+        'normalize': True,
+        'target_dbfs': -18.0,  # RMS speech level
+        'max_gain_db': 12.0,
+        'frame_ms': 20,  # Time stretching frame, and how far it may shift to line up the waveform
+        'search_ms': 8,
+    },
+    'translate': {
+        'SourceLanguageCode': 'en',
+        'TargetLanguageCode': 'en',
+    },
+    'bedrock': {
+        'response_streaming': True,
+        'api_request': api_request,
+        # Conversational instruction for natural dialogue
+        'system_prompt': "You are having a friendly, natural conversation. Respond as you would in a real-time voice chat - be conversational, engaging, and avoid bullet points or lists. Keep responses concise but natural, as if you're talking to a friend.",
+    }
+}
+
+
+def check_model_id():
+    # Called by the entry points, so that importing this module never exits
+    if model_id not in get_model_ids():
+        print(f'Error: Models ID {model_id} in not a valid model ID. Set MODEL_ID env var to one of {get_model_ids()}.')
+        sys.exit(0)
+    if not get_model(model_id).streaming:
+        print(f'Error: Model {model_id} cannot stream its answers, which voice chat needs.')
+        sys.exit(0)
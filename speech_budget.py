@@ -0,0 +1,46 @@
+# How long an answer takes to speak, estimated from its words at the prosody rate it is read at, so that generation can
+# be capped (max_tokens) and stopped once the answer is long enough to listen to
+
+# Relative speed of the SSML prosody rate names
+NAMED_RATES = {'x-slow': 0.6, 'slow': 0.8, 'medium': 1.0, 'fast': 1.25, 'x-fast': 1.5}
+TOKENS_PER_WORD = 1.4  # English text, across the supported tokenizers
+
+
+def parse_rate(speech_rate):
+    # '150%', '1.5', a prosody name, or None for the voice's own rate
+    if not speech_rate:
+        return 1.0
+    speech_rate = str(speech_rate).strip()
+    if speech_rate in NAMED_RATES:
+        return NAMED_RATES[speech_rate]
+    if speech_rate.endswith('%'):
+        return float(speech_rate[:-1]) / 100
+    return float(speech_rate)
+
+
+def spoken_seconds(text, speech_rate=None, words_per_minute=160):
+    return len(text.split()) * 60 / (words_per_minute * parse_rate(speech_rate))
+
+
+def max_tokens_for(seconds, speech_rate=None, words_per_minute=160, margin=1.5):
+    # Output tokens an answer of `seconds` needs, with `margin` to spare so the stop can wait for the end of a sentence
+    words = seconds * words_per_minute * parse_rate(speech_rate) / 60
+    return int(words * TOKENS_PER_WORD * margin) + 1
+
+
+class SpeechGovernor:
+    # Adds up the spoken length of the sentences of one answer; once it reaches `max_seconds` the answer ends there
+
+    def __init__(self, max_seconds, speech_rate=None, words_per_minute=160):
+        self.max_seconds = max_seconds
+        self.speech_rate = speech_rate
+        self.words_per_minute = words_per_minute
+        self.seconds = 0.0
+        self.stopped = False
+
+    def add(self, sentence):
+        # True when the answer is long enough with this sentence
+        self.seconds += spoken_seconds(sentence, self.speech_rate, self.words_per_minute)
+        if self.seconds >= self.max_seconds:
+            self.stopped = True
+        return self.stopped
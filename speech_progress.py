@@ -0,0 +1,146 @@
+import asyncio
+import json
+import re
+
+from speech_budget import spoken_seconds
+
+# Which words of an answer were heard before it was interrupted. Polly's word speech marks (a second synthesize_speech
+# request for the same text, with OutputFormat json) give the time each word starts in the audio; against the PCM bytes
+# written to the output device they tell the word playback stopped in. Without marks, e.g. for a sentence whose marks
+# have not arrived yet, the words are assumed to be evenly spread over the audio.
+
+
+def parse_speech_marks(stream, prefix=0):
+    # [(ms into the audio, start, end)] of the word marks, start and end as UTF-8 byte offsets into the text less the
+    # `prefix` of SSML markup before it
+    words = []
+    for line in stream.read().decode('utf-8').splitlines():
+        if line.strip():
+            mark = json.loads(line)
+            if mark['type'] == 'word':
+                words.append((mark['time'], mark['start'] - prefix, mark['end'] - prefix))
+    return words
+
+
+class SpokenSentence:
+    # One sentence of an answer as it is played: its PCM so far and how much of it was written to the device
+
+    def __init__(self, text, sample_rate, speech_rate=None, marks=None):
+        self.text = text
+        self.encoded = text.encode('utf-8')
+        self.sample_rate = int(sample_rate)
+        self.bytes_per_ms = self.sample_rate * 2 / 1000
+        self.speech_rate = speech_rate
+        self.marks = marks  # Word marks, once they have arrived
+        self.pcm = bytearray()
+        self.played = 0  # Bytes written to the device
+        self.complete = False  # All of the audio was read
+        self.reading = None  # Task of keep_rest() once playback was interrupted
+
+    def set_marks(self, future):
+        # Done callback of the speech marks request; a failed request leaves the estimate
+        if not future.cancelled() and future.exception() is None:
+            self.marks = future.result()
+
+    async def keep_rest(self, stream, pending=None):
+        # After an interrupt: the block that was being read, then the rest of the stream
+        try:
+            if pending is not None:
+                self.pcm += await pending
+        except Exception:
+            stream.close()
+            raise
+        await asyncio.get_running_loop().run_in_executor(None, self.read_rest, stream)
+
+    def read_rest(self, stream):
+        # Blocking; keeps the audio that was not played, so the rest can be played without synthesizing it again
+        try:
+            while True:
+                data = stream.read(65536)
+                if not data:
+                    break
+                self.pcm += data
+            self.complete = True
+        finally:
+            stream.close()
+
+    def words(self):
+        if self.marks:
+            return self.marks
+        if self.complete:
+            duration = len(self.pcm) / self.bytes_per_ms
+        else:
+            duration = max(len(self.pcm) / self.bytes_per_ms, spoken_seconds(self.text, self.speech_rate) * 1000)
+        size = max(len(self.encoded), 1)
+        return [(match.start() / size * duration, match.start(), match.end())
+                for match in re.finditer(rb'\S+', self.encoded)]
+
+    def finished(self):
+        return self.complete and self.played >= len(self.pcm)
+
+    def current_word(self):
+        # (ms, start, end) of the word being played, None before the first one
+        played_ms = self.played / self.bytes_per_ms
+        current = None
+        for word in self.words():
+            if word[0] > played_ms:
+                break
+            current = word
+        return current
+
+    def heard(self):
+        # The text up to the word being played, which was cut off
+        if self.finished():
+            return self.text
+        word = self.current_word()
+        if word is None:
+            return ''
+        return self.encoded[:word[1]].decode('utf-8', 'ignore').strip()
+
+    def rest(self):
+        # What is left to say from the word being played: a SpokenSentence with its PCM, when all of it was read, or
+        # else the text to synthesize again
+        word = self.current_word()
+        at, start = (0, 0) if word is None else word[:2]
+        text = self.encoded[start:].decode('utf-8', 'ignore').rstrip()
+        if not self.complete or not text:
+            return text or None
+
+        rest = SpokenSentence(text, self.sample_rate, self.speech_rate)
+        rest.pcm = self.pcm[int(at * self.bytes_per_ms) & ~1:]
+        rest.complete = True
+        if self.marks:
+            rest.marks = [(time - at, begin - start, end - start) for time, begin, end in self.marks if begin >= start]
+        return rest
+
+
+class SpeechProgress:
+    # The sentences of one answer in playback order, including those queued but never played
+
+    def __init__(self, sample_rate, speech_rate=None):
+        self.sample_rate = sample_rate
+        self.speech_rate = speech_rate
+        self.sentences = []
+
+    def add(self, text, marks=None):
+        sentence = SpokenSentence(text, self.sample_rate, self.speech_rate, marks)
+        self.sentences.append(sentence)
+        return sentence
+
+    async def settled(self):
+        # Waits for the audio of interrupted sentences to be read
+        for sentence in self.sentences:
+            if sentence.reading is not None:
+                try:
+                    await sentence.reading
+                except Exception:
+                    pass
+
+    def heard_text(self):
+        return ' '.join(heard for heard in (sentence.heard() for sentence in self.sentences) if heard)
+
+    def remainder(self):
+        # What was not heard: the rest of the sentence that was cut off, played again from its PCM when possible, then
+        # the texts of the sentences after it
+        rests = (sentence.rest() for sentence in self.sentences if not sentence.finished())
+        return [rest for rest in rests if rest]
@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from latency import percentile
+
+# Cold start cost, measured in fresh interpreters: the wall time of each startup stage, the slowest imports
+# (python -X importtime) and whether the heavy dependencies stay out of `import app`, e.g.
+#   python startup.py --runs 5 --json startup.json
+# The console app itself prints "[STARTUP] Ready to listen ... ms after start" once the first microphone block arrives.
+
+STAGES = {
+    'interpreter': 'pass',
+    'import app': 'import app',
+    'import server': 'import server',
+    'clients ready': 'from session import create_resources; create_resources(8).warm().join()',
+}
+# Only needed once the app runs, so importing it must not load them
+DEFERRED_MODULES = ('boto3', 'botocore', 'amazon_transcribe', 'pyaudio', 'sounddevice')
+
+
+def run(code):
+    # Wall time in ms and the -X importtime report of `code` in a new interpreter
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode:
+        raise RuntimeError(f'{code!r} failed:\n{result.stderr[-2000:]}')
+    return elapsed, parse_importtime(result.stderr)
+
+
+def parse_importtime(report):
+    # [(module, cumulative us, depth)] in report order, from lines like "import time:       654 |     222307 |   vad".
+    # A module's own imports are listed right before it, one level deeper.
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(cumulative), (len(name) - len(name.lstrip()) - 1) // 2))
+    return imports
+
+
+def direct_imports(imports, module):
+    # The modules `module` imported itself (and were not loaded already), with their cumulative ms
+    end = next(i for i, (name, _, depth) in enumerate(imports) if name == module and depth == 0)
+    children = {}
+    for name, cumulative, depth in reversed(imports[:end]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children[name] = round(cumulative / 1000, 1)
+    return dict(sorted(children.items(), key=lambda item: item[1], reverse=True))
+
+
+def run_startup_benchmark(runs, top):
+    results = {'stages': {}}
+    imports = {}
+    for stage, code in STAGES.items():
+        times = []
+        for _ in range(runs):
+            elapsed, imports[stage] = run(code)
+            times.append(elapsed)
+        results['stages'][stage] = {'p50': round(percentile(times, 50), 1), 'max': round(max(times), 1)}
+        print(f"[STARTUP] {stage:<14} p50 {results['stages'][stage]['p50']} ms  max {results['stages'][stage]['max']} ms",
+              flush=True)
+
+    loaded = {name for name, _, _ in imports['import app']}
+    results['app_imports_ms'] = direct_imports(imports['import app'], 'app')
+    results['deferred_loaded'] = [name for name in DEFERRED_MODULES if name in loaded]
+
+    print('[STARTUP] Slowest imports of app, cumulative ms:')
+    for name, ms in list(results['app_imports_ms'].items())[:top]:
+        print(f'[STARTUP]   {name:<24}{ms:>8}')
+    if results['deferred_loaded']:
+        print(f"[STARTUP] Imported by app although only needed later: {', '.join(results['deferred_loaded'])}")
+    else:
+        print(f"[STARTUP] Not imported by app: {', '.join(DEFERRED_MODULES)}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the cold start of the voice app')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per stage')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    results = run_startup_benchmark(args.runs, args.top)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
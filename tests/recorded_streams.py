@@ -0,0 +1,82 @@
+import json
+
+from api_request_schema import api_request_list, get_model
+
+# Streamed chunk payloads of each provider family, as InvokeModelWithResponseStream returns them, with the events around
+# the text and the final chunk that carries the stop reason
+TOKENS = ['Mount', ' Elbrus', ' is', ' 5', '.', '6 km', ' high', '. Dr', '. Smith', ' climbed', ' it', '!',
+          ' Want', ' some', ' tips', ' for', ' the', ' trip', '?', '\n', 'Pack', ' warm']
+ANSWER = ''.join(TOKENS)
+SENTENCES = ['Mount Elbrus is 5.6 km high.', 'Dr. Smith climbed it!', 'Want some tips for the trip?', 'Pack warm']
+
+
+def anthropic_messages_chunks():
+    chunks = [
+        {'type': 'message_start', 'message': {'id': 'msg_1', 'type': 'message', 'role': 'assistant', 'content': [],
+                                              'stop_reason': None, 'usage': {'input_tokens': 21, 'output_tokens': 1}}},
+        {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}},
+    ]
+    chunks += [{'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': token}}
+               for token in TOKENS]
+    chunks += [
+        {'type': 'content_block_stop', 'index': 0},
+        {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+         'usage': {'output_tokens': 22}},
+        {'type': 'message_stop', 'amazon-bedrock-invocationMetrics': {'inputTokenCount': 21, 'outputTokenCount': 22}},
+    ]
+    return chunks
+
+
+def anthropic_completion_chunks():
+    chunks = [{'completion': token, 'stop_reason': None, 'stop': None} for token in TOKENS]
+    chunks.append({'completion': '', 'stop_reason': 'stop_sequence', 'stop': '\n\nHuman:'})
+    return chunks
+
+
+def titan_chunks():
+    chunks = [{'outputText': token, 'index': 0, 'totalOutputTextTokenCount': None, 'completionReason': None,
+               'inputTextTokenCount': 21 if i == 0 else None} for i, token in enumerate(TOKENS)]
+    chunks.append({'outputText': '', 'index': 0, 'totalOutputTextTokenCount': 22, 'completionReason': 'FINISH',
+                   'inputTextTokenCount': None})
+    return chunks
+
+
+def llama_chunks():
+    chunks = [{'generation': token, 'prompt_token_count': 21 if i == 0 else None, 'generation_token_count': i + 1,
+               'stop_reason': None} for i, token in enumerate(TOKENS)]
+    chunks.append({'generation': '', 'prompt_token_count': None, 'generation_token_count': 22, 'stop_reason': 'stop'})
+    return chunks
+
+
+def cohere_chunks():
+    # The last chunk repeats the whole answer
+    chunks = [{'text': token, 'is_finished': False} for token in TOKENS]
+    chunks.append({'is_finished': True, 'finish_reason': 'COMPLETE',
+                   'response': {'id': 'gen_1', 'generations': [{'text': ANSWER, 'finish_reason': 'COMPLETE'}]}})
+    return chunks
+
+
+def cohere_chat_chunks():
+    # stream-end repeats the whole answer and the chat history
+    chunks = [{'is_finished': False, 'event_type': 'stream-start', 'generation_id': 'gen_1'}]
+    chunks += [{'is_finished': False, 'event_type': 'text-generation', 'text': token} for token in TOKENS]
+    chunks.append({'is_finished': True, 'event_type': 'stream-end', 'finish_reason': 'COMPLETE',
+                   'response': {'text': ANSWER, 'chat_history': [{'role': 'USER', 'message': 'How high is Elbrus?'},
+                                                                 {'role': 'CHATBOT', 'message': ANSWER}]}})
+    return chunks
+
+
+RECORDED_STREAMS = {
+    'anthropic-messages': anthropic_messages_chunks,
+    'anthropic-completion': anthropic_completion_chunks,
+    'titan': titan_chunks,
+    'llama': llama_chunks,
+    'cohere': cohere_chunks,
+    'cohere-chat': cohere_chat_chunks,
+}
+
+FAMILIES = sorted({get_model(model_id).family for model_id in api_request_list})
+
+
+def payloads(family):
+    return [json.dumps(chunk).encode() for chunk in RECORDED_STREAMS[family]()]
@@ -0,0 +1,24 @@
+import io
+
+from audio_cache import AudioCache
+
+
+def test_marks_are_kept_with_their_audio(tmp_path):
+    cache = AudioCache(str(tmp_path))
+    key = cache.key('Hello there.', 'Joanna', 'neural', None, '16000')
+    assert cache.get_marks(key) is None
+
+    stream = cache.wrap(key, io.BytesIO(b'\x00' * 64))
+    while stream.read(16):
+        pass
+    cache.put_marks(key, [(0, 0, 5), (310, 6, 12)])
+    assert AudioCache(str(tmp_path)).get_marks(key) == [(0, 0, 5), (310, 6, 12)]
+
+    cache.forget(key)
+    assert cache.get_marks(key) is None
+
+
+def test_marks_without_audio_are_dropped_on_load(tmp_path):
+    cache = AudioCache(str(tmp_path))
+    cache.put_marks('orphan', [(0, 0, 5)])
+    assert AudioCache(str(tmp_path)).get_marks('orphan') is None
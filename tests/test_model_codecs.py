@@ -0,0 +1,38 @@
+import pytest
+
+from model_codecs import build_converse_request, inference_config, model_codecs
+from recorded_streams import ANSWER, FAMILIES, RECORDED_STREAMS, payloads
+
+
+def test_every_family_is_recorded():
+    assert set(FAMILIES) <= set(RECORDED_STREAMS)
+
+
+@pytest.mark.parametrize('family', FAMILIES)
+def test_decode_keeps_text_and_skips_stop_events(family):
+    codec = model_codecs[family]
+    texts = [codec.decode(payload) for payload in payloads(family)]
+
+    assert ''.join(texts) == ANSWER
+    # The chunk carrying the stop reason adds no text, even where it repeats the answer
+    assert texts[-1] == ''
+
+
+def test_inference_config_keeps_zero_values():
+    assert inference_config({'max_tokens': 300, 'temperature': 0, 'top_p': 0.0}) == {
+        'maxTokens': 300, 'temperature': 0, 'topP': 0.0}
+
+
+def test_converse_system_prompt():
+    history = [('Hi', 'Hello!')]
+    claude = build_converse_request({'modelId': 'anthropic.claude-3-haiku-20240307-v1:0', 'body': {}}, 'How high?',
+                                    'Be brief.', history)
+    assert claude['system'] == [{'text': 'Be brief.'}]
+    assert claude['messages'][0]['content'][0]['text'] == 'Hi'
+
+    # Titan has no system prompt, it opens the conversation instead
+    titan = build_converse_request({'modelId': 'amazon.titan-text-premier-v1:0', 'body': {}}, 'How high?',
+                                   'Be brief.', history)
+    assert 'system' not in titan
+    assert titan['messages'][0]['content'][0]['text'] == 'Be brief.\n\nHi'
+    assert titan['messages'][-1]['content'][0]['text'] == 'How high?'
@@ -0,0 +1,47 @@
+import os
+import threading
+
+from response_cache import ResponseCache
+
+
+def test_put_and_get_from_disk(tmp_path):
+    ResponseCache(str(tmp_path)).put('k', ['Hello there.'], [b'\x01\x02' * 100])
+
+    entry = ResponseCache(str(tmp_path)).get('k')
+    assert entry.sentences == ['Hello there.']
+    assert entry.load_audio() == b'\x01\x02' * 100
+
+
+def test_audio_and_marks_per_sentence(tmp_path):
+    marks = [[(0, 0, 5), (300, 6, 11)], None]
+    ResponseCache(str(tmp_path)).put('k', ['Hello there.', 'Bye.'], [b'\x01' * 10, b'\x02' * 6], marks)
+
+    entry = ResponseCache(str(tmp_path)).get('k')
+    assert entry.audio_lengths == [10, 6]
+    assert entry.load_audio() == b'\x01' * 10 + b'\x02' * 6
+    assert entry.marks == [[[0, 0, 5], [300, 6, 11]], None]
+
+
+def test_concurrent_puts_of_one_key(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    errors = []
+
+    def put(i):
+        # Each writer's audio is one repeated byte, so a mix of writers would show
+        audio = bytes([i]) * 4096
+        try:
+            for _ in range(100):
+                cache.put('k', [f'Answer {i}.'], [audio])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put, args=(i,)) for i in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    audio = ResponseCache(str(tmp_path)).get('k').load_audio()
+    assert len(audio) == 4096 and len(set(audio)) == 1
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
@@ -0,0 +1,60 @@
+import pytest
+
+from model_codecs import model_codecs
+from recorded_streams import FAMILIES, SENTENCES, payloads
+from sentence_segmenter import SentenceSegmenter
+
+
+@pytest.mark.parametrize('family', FAMILIES)
+def test_segmenter_splits_decoded_stream(family):
+    codec = model_codecs[family]
+    segmenter = SentenceSegmenter()
+    sentences = []
+    for payload in payloads(family):
+        sentences += segmenter.feed(codec.decode(payload))
+    emitted_before_end = len(sentences)
+    sentences += segmenter.flush()
+
+    assert sentences == SENTENCES
+    # Only the unterminated last sentence waits for the end of the stream
+    assert emitted_before_end == len(SENTENCES) - 1
+
+
+def test_segmenter_emits_first_sentence_before_stream_ends():
+    segmenter = SentenceSegmenter()
+    assert segmenter.feed('Yes') == []
+    assert segmenter.feed('. And') == ['Yes.']
+
+
+def test_segmenter_flushes_stalled_words():
+    now = [0.0]
+    segmenter = SentenceSegmenter(stall_timeout=0.5, clock=lambda: now[0])
+    assert segmenter.feed('Let me think about th') == []
+    assert segmenter.poll() == []
+
+    now[0] = 0.6
+    assert segmenter.time_until_flush() == 0.0
+    # Cut after the last whole word, the half-streamed one waits
+    assert segmenter.poll() == ['Let me think about']
+    assert segmenter.flush() == ['th']
+
+
+def test_segmenter_splits_over_long_text():
+    segmenter = SentenceSegmenter(max_chars=30)
+    sentences = segmenter.feed('one two three four five six seven eight nine ten eleven')
+    assert sentences and all(len(sentence) <= 30 for sentence in sentences)
+
+
+def test_segmenter_keeps_numbers_and_abbreviations():
+    segmenter = SentenceSegmenter(min_chars=1)
+    sentences = segmenter.feed('It costs 3.5 dollars, e.g. at Mr. Smith\'s shop. See No. 5 on the list. Ok')
+    assert sentences == ["It costs 3.5 dollars, e.g. at Mr. Smith's shop.", 'See No. 5 on the list.']
+
+
+def test_segmenter_ends_sentence_on_no():
+    segmenter = SentenceSegmenter()
+    assert segmenter.feed('No.') == []
+    assert segmenter.feed(' The store') == ['No.']
+    segmenter = SentenceSegmenter()
+    assert segmenter.feed('Sadly the answer is no. The store closes at five. Ok') == [
+        'Sadly the answer is no.', 'The store closes at five.']
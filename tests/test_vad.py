@@ -0,0 +1,35 @@
+from vad import Endpointer
+
+
+def test_commits_after_speech_and_silence():
+    endpointer = Endpointer(frame_ms=20, silence_ms=600)
+    endpointer.on_frames([True] * 10)
+    endpointer.on_frames([False] * 29)
+    assert not endpointer.should_commit()
+    endpointer.on_frames([False])
+    assert endpointer.should_commit()
+
+
+def test_final_result_shortens_the_window():
+    endpointer = Endpointer(frame_ms=20, silence_ms=600, final_silence_ms=250)
+    endpointer.on_frames([True] * 10)
+    endpointer.on_result(is_partial=False)
+    endpointer.on_frames([False] * 13)
+    assert endpointer.should_commit()
+
+
+def test_commits_final_result_the_vad_never_heard():
+    # Soft speech below the noise margin: every frame is silence, but Transcribe returned words
+    endpointer = Endpointer(frame_ms=20, silence_ms=600)
+    endpointer.on_frames([False] * 100)
+    assert not endpointer.should_commit()
+
+    endpointer.on_result(is_partial=False)
+    endpointer.on_frames([False] * 29)
+    assert not endpointer.should_commit()
+    endpointer.on_frames([False])
+    assert endpointer.should_commit()
+
+    # A new partial result means the user carries on
+    endpointer.on_result(is_partial=True)
+    assert not endpointer.should_commit()
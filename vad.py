@@ -0,0 +1,207 @@
+import sys
+import time
+import wave
+from collections import deque
+
+import numpy as np
+
+
+class EnergyVad:
+    # Frame-level voice activity from log energy against an adaptive noise floor, with a zero-crossing
+    # rate ceiling to reject hiss and other broadband noise.
+
+    def __init__(self, sample_rate=16000, frame_ms=20, margin_db=10.0, min_energy_db=-55.0, max_zcr=0.4,
+                 noise_adapt=0.05, hangover_ms=100):
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.frame_ms = frame_ms
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.max_zcr = max_zcr
+        self.noise_adapt = noise_adapt
+        self.hangover_frames = max(0, hangover_ms // frame_ms)
+
+        self.noise_floor_db = None
+        self.hangover = 0
+        self.remainder = np.zeros(0, dtype=np.int16)
+
+    def process(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if len(self.remainder):
+            samples = np.concatenate([self.remainder, samples])
+
+        count = len(samples) // self.frame_len
+        self.remainder = samples[count * self.frame_len:].copy()
+        if count == 0:
+            self.energy_db = np.zeros(0, dtype=np.float32)
+            return np.zeros(0, dtype=bool)
+
+        frames = samples[:count * self.frame_len].reshape(count, self.frame_len).astype(np.float32) / 32768.0
+        energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        zcr = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1) / self.frame_len
+        self.energy_db = energy_db  # Of the frames just returned
+
+        if self.noise_floor_db is None:
+            self.noise_floor_db = float(np.min(energy_db))
+
+        raw = (energy_db > self.noise_floor_db + self.margin_db) & (energy_db > self.min_energy_db) & (zcr < self.max_zcr)
+
+        # The noise floor follows the quiet frames only, so sustained speech does not raise it
+        quiet = energy_db[~raw]
+        if len(quiet):
+            weight = min(1.0, self.noise_adapt * len(quiet))
+            self.noise_floor_db += weight * (float(np.mean(quiet)) - self.noise_floor_db)
+
+        return self.apply_hangover(raw)
+
+    def apply_hangover(self, raw):
+        # Bridges short dips between syllables; a handful of frames per block, so a Python loop is fine
+        speech = raw.copy()
+        for i, is_speech in enumerate(raw):
+            if is_speech:
+                self.hangover = self.hangover_frames
+            elif self.hangover > 0:
+                self.hangover -= 1
+                speech[i] = True
+        return speech
+
+    def reset(self):
+        self.hangover = 0
+        self.remainder = np.zeros(0, dtype=np.int16)
+
+
+class Endpointer:
+    # Decides when the user finished a turn from VAD frames and Transcribe results. The silence window adapts
+    # to the pauses this user makes mid-utterance, so slow speakers are not cut off and fast ones wait less.
+
+    def __init__(self, frame_ms=20, silence_ms=600, final_silence_ms=250, max_silence_ms=1500, pause_history=20):
+        self.frame_ms = frame_ms
+        self.silence_ms = silence_ms
+        self.final_silence_ms = final_silence_ms
+        self.max_silence_ms = max_silence_ms
+        self.pause_history = pause_history
+
+        self.pauses = []
+        self.reset()
+
+    def reset(self):
+        self.speech_seen = False
+        self.silence_run_ms = 0
+        self.final_pending = False
+        self.since_final_ms = 0
+
+    def on_frames(self, speech):
+        for is_speech in speech:
+            if is_speech:
+                if self.speech_seen and self.silence_run_ms >= 2 * self.frame_ms:
+                    # The user paused and carried on, remember how long they paused for
+                    self.pauses.append(self.silence_run_ms)
+                    del self.pauses[:-self.pause_history]
+                self.speech_seen = True
+                self.silence_run_ms = 0
+                self.final_pending = False
+            else:
+                self.silence_run_ms += self.frame_ms
+            self.since_final_ms += self.frame_ms
+
+    def on_result(self, is_partial):
+        self.final_pending = not is_partial
+        if not is_partial:
+            self.since_final_ms = 0
+
+    def silence_window_ms(self):
+        if not self.pauses:
+            return self.silence_ms
+        ordered = sorted(self.pauses)
+        p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+        return min(self.max_silence_ms, max(self.silence_ms, int(p90 * 1.25)))
+
+    def should_commit(self):
+        if not self.speech_seen:
+            # Soft speech in a noisy room can be transcribed without a frame clearing the noise floor: a final result
+            # and a whole silence window without a new one end the turn anyway
+            return self.final_pending and self.since_final_ms >= self.silence_window_ms()
+        if self.final_pending and self.silence_run_ms >= self.final_silence_ms:
+            # Transcribe already closed the segment, only a short confirmation of silence is needed
+            return True
+        return self.silence_run_ms >= self.silence_window_ms()
+
+
+def pcm_dbfs(pcm):
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    return 10.0 * np.log10(np.mean(samples * samples) + 1e-10) if len(samples) else -100.0
+
+
+class PlaybackLevel:
+    # Level of the audio recently sent to the output, for the barge-in echo guard. The window covers the output
+    # buffer and the room, which delay the echo.
+
+    def __init__(self, window_ms=300):
+        self.window = window_ms / 1000
+        self.levels = deque()  # (monotonic time, dBFS) per chunk
+
+    def add(self, pcm):
+        self.levels.append((time.monotonic(), pcm_dbfs(pcm)))
+
+    def current(self):
+        # Loudest recent chunk, None when nothing played lately
+        cutoff = time.monotonic() - self.window
+        while self.levels and self.levels[0][0] < cutoff:
+            self.levels.popleft()
+        return max(level for _, level in self.levels) if self.levels else None
+
+
+class BargeInDetector:
+    # Detects the user talking over playback. There is no echo cancellation, so the speaker output leaks into the
+    # microphone: speech has to clear a wider margin over the room noise floor, be louder than the audio being played
+    # (plus playback_margin_db) and last min_speech_ms to count.
+
+    def __init__(self, sample_rate=16000, frame_ms=20, echo_margin_db=18.0, min_speech_ms=120, playback_margin_db=-6.0):
+        self.vad = EnergyVad(sample_rate=sample_rate, frame_ms=frame_ms, margin_db=echo_margin_db, hangover_ms=0)
+        self.min_frames = max(1, min_speech_ms // frame_ms)
+        self.playback_margin_db = playback_margin_db
+        self.run = 0
+
+    def process(self, pcm, armed, playback_dbfs=None):
+        # Frames are fed while the user speaks too, so the noise floor tracks the room and not the playback
+        speech = self.vad.process(pcm)
+        if not armed:
+            self.run = 0
+            return False
+
+        if playback_dbfs is not None:
+            speech = speech & (self.vad.energy_db > playback_dbfs + self.playback_margin_db)
+        for is_speech in speech:
+            self.run = self.run + 1 if is_speech else 0
+            if self.run >= self.min_frames:
+                self.run = 0
+                return True
+        return False
+
+
+def benchmark(paths, block_frames=4096, **endpointer_args):
+    # Runs recorded 16-bit mono WAV files through the VAD and endpointer as the microphone would deliver them
+    for path in paths:
+        with wave.open(path, 'rb') as f:
+            sample_rate = f.getframerate()
+            pcm = f.readframes(f.getnframes())
+
+        vad = EnergyVad(sample_rate=sample_rate)
+        endpointer = Endpointer(frame_ms=vad.frame_ms, **endpointer_args)
+        block_bytes = block_frames * 2
+        endpoints = []
+        started = time.perf_counter()
+
+        for offset in range(0, len(pcm), block_bytes):
+            endpointer.on_frames(vad.process(pcm[offset:offset + block_bytes]))
+            if endpointer.should_commit():
+                endpoints.append((offset + block_bytes) / 2 / sample_rate)
+                endpointer.reset()
+
+        elapsed = time.perf_counter() - started
+        duration = len(pcm) / 2 / sample_rate
+        print(f'{path}: {duration:.2f}s audio, endpoints at {[round(t, 2) for t in endpoints]}s, '
+              f'real-time factor {elapsed / duration:.5f}')
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1:])
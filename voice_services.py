@@ -0,0 +1,544 @@
+import asyncio
+import functools
+import io
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from latency import percentile
+from logs import get_logger
+from speech_budget import parse_rate
+from speech_progress import SpokenSentence, parse_speech_marks
+from vad import PlaybackLevel
+
+
+# boto3 has no asyncio API, so every blocking call below runs on the loop's default executor: one bounded pool
+# shared by all turns (and sessions), set up by the caller and shut down with the loop. Nothing here creates
+# threads per turn.
+
+bedrock_log = get_logger('bedrock')
+polly_log = get_logger('polly')
+playback_log = get_logger('playback')
+
+
+class TextStream:
+    # Async view over a blocking Bedrock event stream. One pooled thread iterates the stream for its whole
+    # lifetime and hands decoded text to the loop; the consumer can wait on it with a timeout.
+
+    def __init__(self, event_stream, decode_event, metadata=None):
+        self.event_stream = event_stream
+        self.decode_event = decode_event
+        self.metadata = {} if metadata is None else metadata  # Filled by decode_event, complete at the end of the stream
+        self.received = []  # Every text chunk read from the service, consumed or not
+        self.first_text_at = None  # time.monotonic() of the first and the latest text chunk
+        self.last_text_at = None
+        self.complete = False  # The service ended the stream, it was neither closed early nor failed
+        self.head = None  # First item, when it was waited for by peek()
+        self.queue = asyncio.Queue()
+        self.done = object()
+        self.closed = False
+
+        self.loop = asyncio.get_running_loop()
+        self.reader = self.loop.run_in_executor(None, self.read_events)
+
+    def put(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # The loop is gone, nobody is listening any more
+            pass
+
+    def read_events(self):
+        try:
+            for event in self.event_stream:
+                text = self.decode_event(event)
+                if text:
+                    self.last_text_at = time.monotonic()
+                    if self.first_text_at is None:
+                        self.first_text_at = self.last_text_at
+                    self.received.append(text)
+                    self.put(text)
+            self.complete = not self.closed
+        except Exception as e:
+            # Closing the stream under the reader is how a turn is cancelled, that is not an error
+            if not self.closed:
+                self.put(e)
+        self.put(self.done)
+
+    async def peek(self):
+        # Waits until the first chunk, the end of the stream or an error arrived, without consuming it
+        if self.head is None:
+            self.head = await self.queue.get()
+        if isinstance(self.head, Exception):
+            raise self.head
+
+    async def next(self, timeout=None):
+        # Returns the next text chunk, None if `timeout` seconds passed without one,
+        # and raises StopAsyncIteration at the end of the stream
+        if self.head is not None:
+            item, self.head = self.head, None
+        else:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        if item is self.done:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.event_stream.close()
+
+
+class BedrockStreamer:
+
+    def __init__(self, client, latency=None, model_id=None, replaces=None):
+        self.client = client
+        self.latency = latency
+        # E.g. a cross-region inference profile, used instead of `replaces` (the configured model), or of any model
+        self.model_id = model_id
+        self.replaces = replaces
+
+    def target(self, model_id):
+        if self.model_id and self.replaces in (None, model_id):
+            return self.model_id
+        return model_id
+
+    async def stream(self, api_request, body_json, decode_chunk):
+        if self.latency:
+            self.latency.mark('bedrock_request')
+
+        future = asyncio.get_running_loop().run_in_executor(None, functools.partial(
+            self.client.invoke_model_with_response_stream,
+            body=body_json,
+            modelId=self.target(api_request['modelId']),
+            accept=api_request['accept'],
+            contentType=api_request['contentType'],
+        ))
+        response = await self.send(future, 'body')
+
+        def decode_event(event):
+            chunk = event.get('chunk')
+            return decode_chunk(chunk) if chunk else ''
+
+        return TextStream(response.get('body'), decode_event)
+
+    async def converse(self, request):
+        # ConverseStream events arrive already parsed and in the same shape for every model
+        if self.latency:
+            self.latency.mark('bedrock_request')
+
+        if self.target(request['modelId']) != request['modelId']:
+            request = dict(request, modelId=self.target(request['modelId']))
+        future = asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.client.converse_stream, **request))
+        response = await self.send(future, 'stream')
+        metadata = {}
+
+        def decode_event(event):
+            if 'contentBlockDelta' in event:
+                return event['contentBlockDelta']['delta'].get('text', '')
+            if 'messageStop' in event:
+                metadata['stop_reason'] = event['messageStop'].get('stopReason')
+            elif 'metadata' in event:
+                usage = event['metadata'].get('usage', {})
+                metadata['input_tokens'] = usage.get('inputTokens')
+                metadata['output_tokens'] = usage.get('outputTokens')
+                metadata['bedrock_latency_ms'] = event['metadata'].get('metrics', {}).get('latencyMs')
+            return ''
+
+        return TextStream(response['stream'], decode_event, metadata)
+
+    @staticmethod
+    async def send(future, stream_key):
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The request is already on the wire, its stream is closed as soon as it opens
+            future.add_done_callback(functools.partial(close_response, stream_key=stream_key))
+            raise
+
+
+# Worth retrying after a pause, on the same endpoint
+RETRYABLE_ERRORS = {'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                    'ModelNotReadyException'}
+
+
+class HedgedStreamer:
+    # Same interface as BedrockStreamer, over several endpoints (regions or inference profiles). The first endpoint is
+    # asked right away; if no token arrived by the hedge deadline the next one is asked too, and whichever streams first
+    # wins while the others are closed. An endpoint that fails moves the request on to the next one at once.
+
+    def __init__(self, streamers, first_token_times=None, hedge_after=1.5, hedge_percentile=95, min_samples=20,
+                 max_attempts=3, backoff=0.2, stats=None):
+        self.streamers = streamers
+        # Seconds to first token of recent requests, shared by every session of the process
+        self.first_token_times = deque(maxlen=200) if first_token_times is None else first_token_times
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.stats = {} if stats is None else stats
+
+    def count(self, name):
+        self.stats[name] = self.stats.get(name, 0) + 1
+
+    def deadline(self):
+        # Until enough requests were seen, the configured value; then the recent tail latency to first token
+        if len(self.first_token_times) < self.min_samples:
+            return self.hedge_after
+        return percentile(list(self.first_token_times), self.hedge_percentile)
+
+    async def stream(self, api_request, body_json, decode_chunk):
+        return await self.race(lambda streamer: streamer.stream(api_request, body_json, decode_chunk))
+
+    async def converse(self, request):
+        return await self.race(lambda streamer: streamer.converse(request))
+
+    async def attempt(self, streamer, open_stream):
+        # Opens the stream and waits for its first token; throttling, also mid-stream, is retried with jittered backoff
+        from botocore.exceptions import ClientError  # Loaded with the clients by now
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_attempts):
+            started = loop.time()
+            text_stream = None
+            try:
+                text_stream = await open_stream(streamer)
+                await text_stream.peek()
+                self.first_token_times.append(loop.time() - started)
+                return text_stream
+            except ClientError as e:
+                if text_stream is not None:
+                    text_stream.close()
+                if e.response.get('Error', {}).get('Code') not in RETRYABLE_ERRORS or attempt == self.max_attempts - 1:
+                    raise
+                self.count('retries')
+                bedrock_log.debug('%s, retrying (attempt %d)', e.response['Error']['Code'], attempt + 2)
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            except BaseException:
+                if text_stream is not None:
+                    text_stream.close()
+                raise
+
+    async def race(self, open_stream):
+        loop = asyncio.get_running_loop()
+        self.count('requests')
+        pending = {loop.create_task(self.attempt(self.streamers[0], open_stream))}
+        started = {next(iter(pending)): 0}
+        next_endpoint = 1
+        error = None
+        try:
+            while pending:
+                timeout = self.deadline() if next_endpoint < len(self.streamers) else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    for task in winners[1:]:
+                        task.result().close()
+                    if started[winners[0]] > 0:
+                        self.count('hedge_wins')
+                    return winners[0].result()
+
+                if done:
+                    error = next(iter(done)).exception()
+                    if pending or next_endpoint >= len(self.streamers):
+                        continue
+                    self.count('failovers')
+                    bedrock_log.debug('Endpoint failed with %r, failing over to endpoint %d', error, next_endpoint)
+                else:
+                    self.count('hedges')
+                    bedrock_log.debug('No first token after %.2f s, hedging to endpoint %d', timeout, next_endpoint)
+
+                task = loop.create_task(self.attempt(self.streamers[next_endpoint], open_stream))
+                started[task] = next_endpoint
+                pending.add(task)
+                next_endpoint += 1
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(close_stream)
+
+
+class PollySynthesizer:
+
+    def __init__(self, client, polly_config, audio_cache=None, latency=None):
+        self.client = client
+        self.polly_config = polly_config
+        self.audio_cache = audio_cache
+        self.latency = latency
+
+    def mark(self, name):
+        if self.latency:
+            self.latency.mark(name)
+
+    def cache_key(self, data, speech_rate):
+        if not self.audio_cache:
+            return None
+        return self.audio_cache.key(
+            data,
+            self.polly_config['VoiceId'],
+            self.polly_config['Engine'],
+            speech_rate,
+            self.polly_config['SampleRate'],
+        )
+
+    def synthesize(self, data, speech_rate):
+        # Blocking; returns a file-like PCM stream, served from the audio cache when possible
+        key = self.cache_key(data, speech_rate)
+        if key:
+            cached = self.audio_cache.get(key)
+            if cached:
+                polly_log.debug('Audio cache hit: %s', data)
+                self.mark('polly_first_byte')
+                return cached
+
+        text, text_type, _ = self.polly_text(data, speech_rate)
+        polly_log.debug('Synthesizing: %s', data)
+        response = self.client.synthesize_speech(
+            Text=text,
+            TextType=text_type,
+            Engine=self.polly_config['Engine'],
+            LanguageCode=self.polly_config['LanguageCode'],
+            VoiceId=self.polly_config['VoiceId'],
+            OutputFormat=self.polly_config['OutputFormat'],
+            SampleRate=self.polly_config['SampleRate'],
+        )
+        self.mark('polly_first_byte')
+
+        if key:
+            return self.audio_cache.wrap(key, response['AudioStream'])
+        return response['AudioStream']
+
+    @staticmethod
+    def polly_text(data, speech_rate):
+        # (text, text type, bytes of markup before `data`)
+        if speech_rate:
+            # Wrap text in SSML to control speech rate
+            prefix = f'<speak><prosody rate="{speech_rate}">'
+            return f'{prefix}{data}</prosody></speak>', 'ssml', len(prefix.encode('utf-8'))
+        return data, 'text', 0
+
+    def speech_marks(self, data, speech_rate):
+        # Blocking; the word marks of the audio synthesize() returns for the same text, see speech_progress.py. They are
+        # cached next to its audio.
+        key = self.cache_key(data, speech_rate)
+        if key:
+            marks = self.audio_cache.get_marks(key)
+            if marks is not None:
+                return marks
+
+        text, text_type, prefix = self.polly_text(data, speech_rate)
+        response = self.client.synthesize_speech(
+            Text=text,
+            TextType=text_type,
+            Engine=self.polly_config['Engine'],
+            LanguageCode=self.polly_config['LanguageCode'],
+            VoiceId=self.polly_config['VoiceId'],
+            OutputFormat='json',
+            SpeechMarkTypes=self.polly_config['SpeechMarkTypes'],
+        )
+        stream = response['AudioStream']
+        try:
+            marks = parse_speech_marks(stream, prefix)
+        finally:
+            stream.close()
+        if key:
+            self.audio_cache.put_marks(key, marks)
+        return marks
+
+    async def synthesize_async(self, data, speech_rate):
+        future = asyncio.get_running_loop().run_in_executor(None, self.synthesize, data, speech_rate)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # A running Polly call cannot be aborted, its stream is closed as soon as it arrives
+            future.add_done_callback(close_stream)
+            raise
+
+
+class AudioSink:
+    # Async front of a blocking output device (anything with write/drain). Writes go through a single dedicated
+    # thread so they stay in order and never wait behind network calls in the shared pool.
+
+    def __init__(self, output):
+        self.output = output
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-out')
+
+    async def write(self, data):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.output.write, data)
+
+    async def drain(self):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.output.drain)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.output.close()
+
+
+def close_stream(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def close_response(future, stream_key='body'):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[stream_key].close()
+
+
+def discard_audio(future):
+    if future.done():
+        close_stream(future)
+    else:
+        future.cancel()
+
+
+class Speaker:
+    # Producer/consumer playback: sentences are synthesized up to `lookahead` ahead of the one playing,
+    # and played strictly in order. Cancelling the awaiting task stops playback at the next write.
+
+    def __init__(self, synthesizer, sink, lookahead=2, chunk=1024, read_size=8192, latency=None, effects=None):
+        self.synthesizer = synthesizer
+        self.sink = sink
+        self.lookahead = lookahead
+        self.chunk = chunk
+        self.read_size = read_size
+        self.latency = latency
+        self.effects = effects  # AudioEffects between Polly and the device, see audio_effects.py
+        self.level = PlaybackLevel()  # What is being played, for the barge-in echo guard
+        self.speed = 1.0  # The listener's own factor over the speech rate, with time stretching
+        self.rate = 1.0
+
+    def synthesis_rate(self, speech_rate):
+        # With time stretching, Polly speaks at the voice's own rate and the speech rate is applied at playback
+        if self.effects is not None and self.effects.time_stretch:
+            return None
+        return speech_rate
+
+    def change_speed(self, factor):
+        # Takes effect within a frame, also in the middle of an answer; thread-safe enough for a float
+        self.speed = min(max(self.speed * factor, 0.5), 2.0)
+        if self.effects is not None:
+            self.effects.set_rate(self.rate * self.speed)
+        return self.speed
+
+    async def speak(self, items, speech_rate='150%', capture=None, progress=None):
+        # `items` is an async iterable of text to synthesize, or of already synthesized file-like PCM streams or
+        # SpokenSentences. With a SpeechProgress, each sentence is recorded as it plays, with its speech marks when
+        # config['polly']['SpeechMarkTypes'] asks for them. `capture` gets the PCM of each item played.
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue(maxsize=self.lookahead)
+        marks = progress is not None and self.synthesizer.polly_config['SpeechMarkTypes']
+        self.rate = parse_rate(speech_rate)
+        if self.effects is not None:
+            self.effects.set_rate(self.rate * self.speed)
+        speech_rate = self.synthesis_rate(speech_rate)
+
+        async def produce():
+            async for item in items:
+                sentence = None
+                if isinstance(item, str):
+                    future = loop.create_task(self.synthesizer.synthesize_async(item, speech_rate))
+                    if progress is not None:
+                        sentence = progress.add(item)
+                    if marks:
+                        # Alongside the audio; only needed if the answer is interrupted, so playback never waits for it
+                        loop.run_in_executor(None, self.synthesizer.speech_marks, item, speech_rate) \
+                            .add_done_callback(sentence.set_marks)
+                else:
+                    future = loop.create_future()
+                    if isinstance(item, SpokenSentence):
+                        future.set_result(io.BytesIO(bytes(item.pcm)))
+                        if progress is not None:
+                            sentence = progress.add(item.text, item.marks)
+                    else:
+                        future.set_result(item)
+                # Waits here once `lookahead` items are ahead of playback
+                await pending.put((future, sentence))
+            await pending.put(None)
+
+        producer = loop.create_task(produce())
+        getter = None
+        current = None
+        try:
+            while True:
+                getter = loop.create_task(pending.get())
+                await asyncio.wait([getter, producer], return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done() and producer.exception() is not None:
+                    # E.g. the Bedrock stream failed, nothing more will be queued
+                    raise producer.exception()
+
+                current = await getter
+                if current is None:
+                    break
+                future, sentence = current
+                if capture is not None:
+                    capture.append(bytearray())
+                await self.play(await future, capture[-1] if capture is not None else None, sentence)
+                current = None
+
+            await self.sink.drain()
+        finally:
+            producer.cancel()
+            if getter is not None:
+                getter.cancel()
+            # Unless play() kept reading it for resuming
+            if current is not None and (current[1] is None or current[1].reading is None):
+                discard_audio(current[0])
+            while not pending.empty():
+                queued = pending.get_nowait()
+                if queued is not None:
+                    discard_audio(queued[0])
+
+    async def play(self, stream, capture=None, sentence=None):
+        loop = asyncio.get_running_loop()
+        pending = None
+        try:
+            while True:
+                pending = loop.run_in_executor(None, stream.read, self.read_size)
+                # An interrupt must not lose the block being read, it belongs to the rest of the sentence
+                data = await asyncio.shield(pending)
+                pending = None
+                if not data:
+                    break
+                playback_log.debug('Playing %d bytes', len(data))
+                if sentence is not None:
+                    sentence.pcm += data
+                await self.write(self.effects.process(data) if self.effects else data, len(data), sentence)
+                # As synthesized, so that stored audio plays at any rate
+                if capture is not None:
+                    capture.extend(data)
+                if self.latency:
+                    self.latency.mark('first_pcm')
+                    self.latency.mark_last('last_pcm')
+            if self.effects:
+                await self.write(self.effects.flush(), 0, sentence)
+            if sentence is not None:
+                sentence.played = len(sentence.pcm)
+                sentence.complete = True
+        finally:
+            if self.effects and (sentence is None or not sentence.complete):
+                self.effects.reset()
+            if sentence is not None and not sentence.complete:
+                # Interrupted: the rest of the audio is kept for resuming, read off the event loop
+                sentence.reading = loop.create_task(sentence.keep_rest(stream, pending))
+            else:
+                stream.close()
+
+    async def write(self, data, source_bytes, sentence=None):
+        # `data` was made from `source_bytes` of synthesized audio, which is what the progress of `sentence` counts in
+        for offset in range(0, len(data), self.chunk):
+            # Small writes keep the cancellation latency at one chunk (32 ms at 16 kHz)
+            chunk = data[offset:offset + self.chunk]
+            await self.sink.write(chunk)
+            self.level.add(chunk)
+            if sentence is not None:
+                sentence.played += len(chunk) * source_bytes // len(data)